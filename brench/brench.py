@@ -5,9 +5,20 @@ import click
 import tomlkit
 import subprocess
 import re
+import shlex
+import signal
 import csv
 import sys
 import os
+import json
+import hashlib
+import contextlib
+import math
+import statistics
+import tempfile
+import threading
+import time
+from collections import namedtuple
 from concurrent import futures
 import glob
 
@@ -15,40 +26,522 @@ __version__ = "1.0.0"
 
 ARGS_RE = r"ARGS: (.*)"
 
+DEFAULT_CACHE = ".brench-cache"
 
-def run_pipe(cmds, input, timeout):
+DEFAULT_HISTORY = ".brench-history.json"
+
+DEFAULT_JOURNAL = ".brench-journal.jsonl"
+
+# Default number of untimed and timed runs of each pipeline in timing mode.
+DEFAULT_WARMUP = 1
+DEFAULT_REPEAT = 10
+
+# Two-sided 95% critical values of Student's t distribution for 1 to 30
+# degrees of freedom. Beyond that, the normal approximation is close enough.
+T95 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+
+# Resource usage for one process: wall-clock, user, and system time in
+# seconds, and its maximum resident set size in kilobytes.
+Usage = namedtuple("Usage", ["wall", "user", "sys", "maxrss"])
+
+
+class Interrupted(Exception):
+    """Raised by a pipeline that `stop_all` killed."""
+
+
+# The processes that are running, so `stop_all` can kill them.
+_running = set()
+_running_lock = threading.Lock()
+_stopping = threading.Event()
+
+
+def _start(cmd, **kwargs):
+    # Start a shell command and register it as running, unless we are
+    # stopping. (Checking after registering means `stop_all` cannot miss
+    # a process that starts while it runs.) Each command gets its own
+    # session, so a Ctrl-C in the terminal only interrupts Brench, which
+    # then stops the commands itself, and so killing a command also kills
+    # anything it started.
+    proc = subprocess.Popen(
+        cmd, shell=True, text=True, start_new_session=True, **kwargs
+    )
+    with _running_lock:
+        _running.add(proc)
+        stopping = _stopping.is_set()
+    if stopping:
+        _kill(proc)
+        raise Interrupted()
+    return proc
+
+
+def _kill(proc):
+    # Kill a command's process group. (`Popen.kill` could race with the
+    # reaper threads in `time_pipe`.)
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _finish(procs):
+    # Unregister a pipeline's processes, and make sure a pipeline that
+    # `stop_all` cut short does not return its partial output.
+    with _running_lock:
+        _running.difference_update(procs)
+    if _stopping.is_set():
+        raise Interrupted()
+
+
+def stop_all():
+    """Kill every running command. Pipelines that are running or that
+    start afterward raise `Interrupted`.
+    """
+    with _running_lock:
+        _stopping.set()
+        procs = list(_running)
+    for proc in procs:
+        if proc.returncode is None:
+            _kill(proc)
+
+
+def run_pipe(cmds, input, timeout, cpus=None):
     """Execute a pipeline of shell commands.
 
     Send the given input (text) string into the first command, then pipe
     the output of each command into the next command in the sequence.
     Collect and return the stdout and stderr from the final command.
+    If `cpus` is a list, pin each command to the corresponding CPU. Raise
+    `Interrupted` if `stop_all` kills the pipeline.
     """
     procs = []
-    for cmd in cmds:
-        last = len(procs) == len(cmds) - 1
-        proc = subprocess.Popen(
-            cmd,
-            shell=True,
-            text=True,
-            stdin=procs[-1].stdout if procs else subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE if last else subprocess.DEVNULL,
+    try:
+        for cmd in cmds:
+            last = len(procs) == len(cmds) - 1
+            with _pinned(cpus, len(procs)):
+                proc = _start(
+                    cmd,
+                    stdin=procs[-1].stdout if procs else subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE if last else subprocess.DEVNULL,
+                )
+            procs.append(proc)
+
+        if len(procs) == 1:
+            out = procs[0].communicate(input, timeout=timeout)
+        else:
+            # Send stdin from another thread (so a large input cannot fill
+            # up the pipes before we start reading) and collect stdout.
+            threading.Thread(
+                target=_feed, args=(procs[0].stdin, input), daemon=True
+            ).start()
+            out = procs[-1].communicate(timeout=timeout)
+    finally:
+        for proc in procs:
+            if proc.returncode is None:
+                _kill(proc)
+        _finish(procs)
+    return out
+
+
+@contextlib.contextmanager
+def _pinned(cpus, i):
+    # Pin the `i`th command of a pipeline to its CPU, if any, while it
+    # starts. On Linux, CPU affinity belongs to a thread, and a new process
+    # inherits it from the thread that starts it, so we pin the current
+    # thread for a moment. (Unlike `Popen`'s `preexec_fn`, this is safe
+    # with other threads running.)
+    if cpus is None:
+        yield
+        return
+    old = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, {cpus[i]})
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, old)
+
+
+def _feed(pipe, data):
+    try:
+        pipe.write(data)
+        pipe.close()
+    except (BrokenPipeError, ValueError):
+        pass  # The pipeline exited (or was killed) early.
+
+
+def time_pipe(cmds, input, timeout, cpus=None):
+    """Execute a pipeline of shell commands, like `run_pipe`, and measure
+    its resource usage.
+
+    Return the stdout and stderr of the final command, the wall-clock
+    time for the whole pipeline, and a list with the `Usage` of each
+    command. Each process is reaped with `os.wait4` as soon as it exits,
+    so its CPU time and maximum RSS include any children it waited for
+    (e.g., the stages of a shell pipeline inside one command). Raise
+    `Interrupted` if `stop_all` kills the pipeline.
+    """
+    procs = []
+    usage = [None] * len(cmds)
+    ends = [None] * len(cmds)
+    reapers = []
+    start = time.perf_counter()
+
+    def reap(i, started):
+        _, status, ru = os.wait4(procs[i].pid, 0)
+        ends[i] = time.perf_counter()
+        usage[i] = Usage(
+            ends[i] - started,
+            ru.ru_utime,
+            ru.ru_stime,
+            ru.ru_maxrss,
         )
-        procs.append(proc)
+        # Let `subprocess` know that the process is gone.
+        procs[i].returncode = os.waitstatus_to_exitcode(status)
 
     try:
-        # Send stdin and collect stdout.
-        procs[0].stdin.write(input)
-        procs[0].stdin.close()
-        return procs[-1].communicate(timeout=timeout)
+        for i, cmd in enumerate(cmds):
+            last = i == len(cmds) - 1
+            started = time.perf_counter()
+            with _pinned(cpus, i):
+                proc = _start(
+                    cmd,
+                    stdin=procs[-1].stdout if procs else subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE if last else subprocess.DEVNULL,
+                )
+            if procs:
+                # Only the next command reads this pipe now.
+                procs[-1].stdout.close()
+            procs.append(proc)
+            reaper = threading.Thread(target=reap, args=(i, started),
+                                      daemon=True)
+            reaper.start()
+            reapers.append(reaper)
+
+        # Feed stdin and drain the output pipes from other threads, so
+        # the main thread can enforce the timeout.
+        outs = [None, None]
+
+        def drain(i, pipe):
+            outs[i] = pipe.read()
+
+        threads = [
+            threading.Thread(target=_feed, args=(procs[0].stdin, input)),
+            threading.Thread(target=drain, args=(0, procs[-1].stdout)),
+            threading.Thread(target=drain, args=(1, procs[-1].stderr)),
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        deadline = start + timeout
+        for thread in threads + reapers:
+            thread.join(max(0.0, deadline - time.perf_counter()))
+            if thread.is_alive():
+                raise subprocess.TimeoutExpired(cmds, timeout)
+
     finally:
-        for proc in procs:
-            proc.kill()
+        # Kill whatever is still running.
+        for i, proc in enumerate(procs):
+            if usage[i] is None:
+                _kill(proc)
+        for reaper in reapers:
+            reaper.join()
+        _finish(procs)
+
+    wall = max(ends) - start
+    return outs[0], outs[1], wall, usage
+
+
+class Slots:
+    """A limit on the number of commands that run at once.
+
+    Every thread that starts a pipeline first takes a slot for each of
+    its commands, since they all run concurrently. Each slot stands for a
+    CPU; with `pin` on, the commands are pinned to the CPUs of their
+    slots.
+    """
+
+    def __init__(self, cpus, pin=False):
+        self.free = list(cpus)
+        self.size = len(self.free)
+        self.pin = pin
+        self.cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def hold(self, n):
+        """Wait for slots for `n` commands and give back a list of the
+        CPUs to pin them to (or None, without pinning).
+
+        A pipeline longer than the limit takes all the slots, and its
+        commands share their CPUs.
+        """
+        k = min(n, self.size)
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.free) >= k)
+            taken = self.free[:k]
+            del self.free[:k]
+        try:
+            yield [taken[i % k] for i in range(n)] if self.pin else None
+        finally:
+            with self.cond:
+                self.free.extend(taken)
+                self.cond.notify_all()
+
+
+def _hold(slots, n):
+    return slots.hold(n) if slots else contextlib.nullcontext()
+
+
+class History:
+    """The running times of previous jobs, for scheduling.
+
+    The file holds a JSON object with a section for each `mode` (normal
+    runs and timing runs take very different amounts of time), which
+    maps the absolute paths of benchmark files to the number of seconds
+    their last job took. Recording times is thread-safe.
+    """
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        self.times = self.data.setdefault(mode, {})
+        self.lock = threading.Lock()
+
+    def expected(self, fn):
+        """Get the last running time for a benchmark, or None."""
+        return self.times.get(os.path.abspath(fn))
+
+    def record(self, fn, seconds):
+        with self.lock:
+            self.times[os.path.abspath(fn)] = round(seconds, 3)
+
+    def order(self, files):
+        """Sort benchmark files so the slowest ones come first. Files
+        without a history go before all the others, in their original
+        order.
+        """
+        def key(fn):
+            seconds = self.expected(fn)
+            return (seconds is not None, -(seconds or 0.0))
+
+        return sorted(files, key=key)
+
+    def save(self):
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        with os.fdopen(fd, "w") as f, self.lock:
+            json.dump(self.data, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class Journal:
+    """A log of the rows that a sweep has finished, so an interrupted
+    sweep can pick up where it left off.
+
+    Each line is a JSON object with the absolute path of a benchmark
+    file, a run name, a key, and the run's CSV row. The key is a dict of
+    everything else that determines the row (see `journal_key`), and a
+    row only counts as done if its key still matches. Without `resume`,
+    the journal starts out empty. Adding rows is thread-safe.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.rows = {}
+        start = ""
+        if resume:
+            try:
+                with open(path) as f:
+                    text = f.read()
+            except OSError:
+                text = ""
+            for line in text.splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # A line cut off by an interruption.
+                self.rows[entry["file"], entry["run"]] = entry
+            if text and not text.endswith("\n"):
+                start = "\n"
+        self.file = open(path, "a" if resume else "w")
+        self.file.write(start)
+        self.lock = threading.Lock()
+
+    def get(self, fn, run, key):
+        """Get the finished row for a benchmark and run, or None."""
+        entry = self.rows.get((os.path.abspath(fn), run))
+        if entry is None or entry.get("key") != key:
+            return None
+        return entry["row"]
+
+    def add(self, fn, rows, key):
+        """Log the rows for some of a benchmark's runs. `rows` maps run
+        names to rows, and `key(run)` gives each one's key.
+        """
+        with self.lock:
+            if self.file.closed:
+                return  # Too late: the sweep was interrupted.
+            for run, row in rows.items():
+                entry = {
+                    "file": os.path.abspath(fn),
+                    "run": run,
+                    "key": key(run),
+                    "row": row,
+                }
+                self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class Cache:
+    """An on-disk cache of pipeline outputs.
+
+    Each entry is keyed by a hash of everything that determines the
+    output: the benchmark file's contents, its arguments, the formatted
+    pipeline commands, the contents of any files that the commands name
+    (e.g., the script in `python3 tdce.py`), and the declared versions of
+    the tools that the commands mention. Changing any of these makes the
+    old entry stale. With `read` off, existing entries are ignored (but
+    replaced).
+    """
+
+    def __init__(self, path, versions=None, read=True):
+        self.path = path
+        self.versions = dict(versions or {})
+        self.read = read
+        self.hits = 0
+        self.file_hashes = {}
 
+    def file_hash(self, path):
+        """Hash the contents of a file, once per sweep."""
+        if path not in self.file_hashes:
+            with open(path, "rb") as f:
+                self.file_hashes[path] = hashlib.sha256(f.read()).hexdigest()
+        return self.file_hashes[path]
 
-def run_bench(pipeline, fn, timeout):
-    """Run a single benchmark pipeline."""
-    # Load the benchmark.
+    def key(self, in_data, args, cmds):
+        h = hashlib.sha256()
+        parts = [in_data, args] + cmds
+        for cmd in cmds:
+            try:
+                words = shlex.split(cmd)
+            except ValueError:
+                words = cmd.split()
+            for word in words:
+                if os.path.isfile(word):
+                    parts.append("{}={}".format(word, self.file_hash(word)))
+        for tool, version in sorted(self.versions.items()):
+            if any(re.search(r"(^|\W){}($|\W)".format(re.escape(tool)), c)
+                   for c in cmds):
+                parts.append("{}={}".format(tool, version))
+        for part in parts:
+            h.update(part.encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key):
+        """Get the `(stdout, stderr)` for a key, or None."""
+        if not self.read:
+            return None
+        try:
+            with open(os.path.join(self.path, key + ".json")) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.hits += 1
+        return entry["stdout"], entry["stderr"]
+
+    def put(self, key, stdout, stderr):
+        os.makedirs(self.path, exist_ok=True)
+        # Write to a temporary file first so concurrent runs (or an
+        # interrupted one) never leave a partial entry.
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"stdout": stdout, "stderr": stderr}, f)
+        os.replace(tmp, os.path.join(self.path, key + ".json"))
+
+
+def run_tree(pipelines, in_data, timeout, slots=None):
+    """Run several pipelines on the same input, running each shared
+    prefix of commands only once.
+
+    `pipelines` maps names to lists of commands. Build a prefix tree of
+    the commands, run each segment of the tree as a pipeline, and feed
+    the output of a segment where the pipelines diverge to each of the
+    segments that follow it. Each pipeline has `timeout` seconds in total
+    across its segments, not counting the time spent waiting for
+    `Slots`. Return a dict mapping each name to the `(stdout, stderr)` of
+    its last command or a `TimeoutExpired` error, and the total number of
+    seconds that the segments took.
+    """
+    results = {}
+    busy = [0.0]
+
+    def run_group(names, depth, input, elapsed):
+        # All of `names` share their first `depth` commands, which have
+        # already run and produced `input`.
+        groups = {}
+        for name in names:
+            cmds = pipelines[name]
+            if len(cmds) == depth:
+                results[name] = (input, "")
+            else:
+                groups.setdefault(cmds[depth], []).append(name)
+
+        for group in groups.values():
+            # Extend the segment as long as the whole group shares it.
+            first = pipelines[group[0]]
+            end = depth + 1
+            while all(
+                len(pipelines[n]) > end and pipelines[n][end] == first[end]
+                for n in group
+            ):
+                end += 1
+
+            with _hold(slots, end - depth) as cpus:
+                start = time.perf_counter()
+                try:
+                    out = run_pipe(
+                        first[depth:end], input, timeout - elapsed, cpus
+                    )
+                except subprocess.TimeoutExpired as exc:
+                    for name in group:
+                        results[name] = exc
+                    continue
+                finally:
+                    busy[0] += time.perf_counter() - start
+                spent = elapsed + time.perf_counter() - start
+
+            rest = [n for n in group if len(pipelines[n]) > end]
+            for name in group:
+                if len(pipelines[name]) == end:
+                    results[name] = out
+            if rest:
+                run_group(rest, end, out[0], spent)
+
+    run_group(list(pipelines), 0, in_data, 0.0)
+    return results, busy[0]
+
+
+def load_bench(pipelines, fn):
+    """Read a benchmark file and fill in its arguments in the pipelines.
+
+    Return the file's contents, its arguments, and a dict mapping each run
+    name to its list of commands.
+    """
     with open(fn) as f:
         in_data = f.read()
 
@@ -56,9 +549,201 @@ def run_bench(pipeline, fn, timeout):
     match = re.search(ARGS_RE, in_data)
     args = match.group(1) if match else ""
 
-    # Run pipeline.
-    cmds = [c.format(args=args) for c in pipeline]
-    return run_pipe(cmds, in_data, timeout)
+    cmds = {
+        name: [c.format(args=args) for c in pipeline]
+        for name, pipeline in pipelines.items()
+    }
+    return in_data, args, cmds
+
+
+def run_bench(pipelines, fn, timeout, cache=None, slots=None,
+              history=None):
+    """Run all the pipelines for a single benchmark, or get their outputs
+    from a `Cache`.
+
+    `pipelines` maps run names to lists of commands. Return a dict
+    mapping each name to its `(stdout, stderr)` or a `TimeoutExpired`
+    error (see `run_tree`). If anything actually ran, record how long it
+    took in the `History`.
+    """
+    in_data, args, cmds = load_bench(pipelines, fn)
+
+    # Look up cached outputs.
+    results = {}
+    keys = {}
+    if cache is not None:
+        for name in cmds:
+            keys[name] = cache.key(in_data, args, cmds[name])
+            out = cache.get(keys[name])
+            if out is not None:
+                results[name] = out
+
+    # Run the rest.
+    todo = {name: c for name, c in cmds.items() if name not in results}
+    fresh = {}
+    if todo:
+        fresh, seconds = run_tree(todo, in_data, timeout, slots)
+        if history is not None:
+            history.record(fn, seconds)
+    if cache is not None:
+        for name, out in fresh.items():
+            # Timeouts are never cached.
+            if not isinstance(out, subprocess.TimeoutExpired):
+                cache.put(keys[name], *out)
+    results.update(fresh)
+    return results
+
+
+def time_bench(pipelines, fn, timeout, counts, slots=None, history=None):
+    """Run and time all the pipelines for a single benchmark.
+
+    `counts` maps each run name to a `(warmup, repeat)` pair: run its
+    pipeline `warmup` times without measuring it, then `repeat` times
+    with `time_pipe`. Every run is a complete pipeline, without the cache
+    or prefix sharing, and `timeout` applies to each one. Return a dict
+    mapping each name to its `(stdout, stderr)` (from the first timed run)
+    or a `TimeoutExpired` error, and a dict mapping each name to the list
+    of `(wall, usage)` measurements. Record the total time in the
+    `History`.
+    """
+    in_data, _, cmds = load_bench(pipelines, fn)
+    results = {}
+    timings = {}
+    total = 0.0
+    for name, (warmup, repeat) in counts.items():
+        timings[name] = []
+        try:
+            for i in range(warmup + repeat):
+                with _hold(slots, len(cmds[name])) as cpus:
+                    start = time.perf_counter()
+                    try:
+                        stdout, stderr, wall, usage = time_pipe(
+                            cmds[name], in_data, timeout, cpus
+                        )
+                    finally:
+                        total += time.perf_counter() - start
+                if i == warmup:
+                    results[name] = (stdout, stderr)
+                if i >= warmup:
+                    timings[name].append((wall, usage))
+        except subprocess.TimeoutExpired as exc:
+            results[name] = exc
+    if history is not None:
+        history.record(fn, total)
+    return results, timings
+
+
+def summarize(samples):
+    """Compute the mean, standard deviation, and median of some samples,
+    and the bounds of a 95% confidence interval for the mean.
+    """
+    mean = statistics.mean(samples)
+    if len(samples) < 2:
+        return mean, 0.0, mean, mean, mean
+    stddev = statistics.stdev(samples)
+    df = len(samples) - 1
+    t = T95[df - 1] if df <= len(T95) else 1.96
+    half = t * stddev / math.sqrt(len(samples))
+    return mean, stddev, statistics.median(samples), mean - half, mean + half
+
+
+TIMING_COLUMNS = [
+    "wall_mean",
+    "wall_stddev",
+    "wall_median",
+    "wall_ci_low",
+    "wall_ci_high",
+    "user_mean",
+    "sys_mean",
+    "maxrss_kb",
+    "stage_wall_mean",
+]
+
+
+def timing_columns(timing):
+    """Format the timing columns of a CSV row from the measurements for
+    one run: statistics for the pipeline's wall-clock time, the mean user
+    and system CPU time (summed over its commands), the largest maximum
+    RSS of any command, and the mean wall-clock time of each command
+    (separated by semicolons).
+    """
+    if not timing:
+        return [""] * len(TIMING_COLUMNS)
+
+    walls = [wall for wall, _ in timing]
+    user = statistics.mean(sum(u.user for u in usage) for _, usage in timing)
+    sys_ = statistics.mean(sum(u.sys for u in usage) for _, usage in timing)
+    maxrss = max(u.maxrss for _, usage in timing for u in usage)
+    stages = [
+        statistics.mean(usage[i].wall for _, usage in timing)
+        for i in range(len(timing[0][1]))
+    ]
+
+    fmt = "{:.6f}".format
+    return (
+        [fmt(x) for x in summarize(walls)]
+        + [fmt(user), fmt(sys_), str(maxrss)]
+        + [";".join(fmt(x) for x in stages)]
+    )
+
+
+def bench_rows(fn, names, outs, timings, extract_re):
+    """Make the CSV rows for a benchmark's runs from their outputs.
+
+    `outs` maps run names to outputs, as from `run_bench`. The first of
+    `names` is the "golden" output. `timings` holds the measurements from
+    `time_bench`, or None outside of timing mode. Return a dict mapping
+    each run name to its row.
+    """
+    bench, _ = os.path.splitext(os.path.basename(fn))
+    rows = {}
+    first_out = None
+    for name in names:
+        out = outs[name]
+        if isinstance(out, subprocess.TimeoutExpired):
+            stdout, stderr = "", ""
+            status = "timeout"
+        else:
+            stdout, stderr = out
+            status = None
+
+        # Check correctness.
+        if first_out is None:
+            first_out = stdout
+        elif stdout != first_out and not status:
+            status = "incorrect"
+
+        # Extract the figure of merit.
+        result = get_result([stdout, stderr], extract_re)
+        if not result and not status:
+            status = "missing"
+
+        row = [bench, name, status if status else result]
+        if timings is not None:
+            row += timing_columns(
+                None if status == "timeout" else timings[name]
+            )
+        rows[name] = row
+    return rows
+
+
+def journal_key(digest, pipeline, golden, extract, timeout, counts=None):
+    """Make the `Journal` key for a run: everything that determines its
+    row besides the benchmark's path and the run's name.
+
+    That is the hash of the benchmark file's contents (which include its
+    arguments), the run's pipeline, the pipeline of the first run (whose
+    output the run is checked against), the `extract` regex, the timeout,
+    and, in timing mode, the run's `(warmup, repeat)` counts.
+    """
+    return {
+        "input": digest,
+        "pipeline": [str(c) for c in pipeline],
+        "golden": [str(c) for c in golden],
+        "extract": str(extract),
+        "timeout": float(timeout),
+        "counts": list(counts) if counts else None,
+    }
 
 
 def get_result(strings, extract_re):
@@ -76,12 +761,47 @@ def get_result(strings, extract_re):
     "--jobs",
     default=None,
     type=int,
-    help="parallel threads to use (default: suitable for machine)",
+    help="commands to run at once (default: one per CPU)",
 )
 @click.option("-p", "--plot", is_flag=True, help="plot the results")
+@click.option(
+    "--cache", "use_cache", is_flag=True, help="use the result cache"
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="rerun everything and update the cache (implies --cache)",
+)
+@click.option(
+    "-t",
+    "--time",
+    "timing",
+    is_flag=True,
+    help="time repeated runs of each pipeline (without the cache)",
+)
+@click.option(
+    "--warmup", default=None, type=int, help="untimed runs before timing"
+)
+@click.option("--repeat", default=None, type=int, help="timed runs")
+@click.option("--pin", is_flag=True, help="pin each command to a CPU")
+@click.option(
+    "--resume", is_flag=True, help="skip the runs finished by the last sweep"
+)
 @click.argument("config_path", metavar="CONFIG", type=click.Path(exists=True))
 @click.argument("files", nargs=-1, type=click.Path(exists=True))
-def brench(config_path, files, jobs, plot):
+def brench(
+    config_path,
+    files,
+    jobs,
+    plot,
+    use_cache,
+    refresh,
+    timing,
+    warmup,
+    repeat,
+    pin,
+    resume,
+):
     """Run a batch of benchmarks and emit a CSV of results."""
     with open(config_path) as f:
         config = tomlkit.loads(f.read())
@@ -92,44 +812,150 @@ def brench(config_path, files, jobs, plot):
 
     timeout = config.get("timeout", 5)
 
-    rows = []
-    with futures.ThreadPoolExecutor(max_workers=jobs) as pool:
-        # Submit jobs.
-        futs = {}
-        for fn in files:
-            for name, run in config["runs"].items():
-                futs[(fn, name)] = pool.submit(run_bench, run["pipeline"], fn, timeout)
+    cache = None
+    if use_cache or refresh:
+        cache = Cache(
+            config.get("cache", DEFAULT_CACHE),
+            {k: str(v) for k, v in config.get("versions", {}).items()},
+            read=not refresh,
+        )
+
+    if timing:
+        # Each run can override the number of warmup and timed runs; the
+        # command line overrides both.
+        counts = {}
+        for name, run in config["runs"].items():
+            counts[name] = (
+                int(warmup if warmup is not None else run.get(
+                    "warmup", config.get("warmup", DEFAULT_WARMUP))),
+                int(repeat if repeat is not None else run.get(
+                    "repeat", config.get("repeat", DEFAULT_REPEAT))),
+            )
+    # Limit the number of commands running at once, giving each one a CPU
+    # in case we pin them. There is no point in more threads than slots.
+    workers = jobs
+    if timing and jobs is None:
+        # Concurrent runs disturb each other's timings, so run one
+        # pipeline at a time unless asked otherwise, with a slot for each
+        # of its commands so they do not share a CPU either.
+        workers = 1
+        jobs = max(len(run["pipeline"]) for run in config["runs"].values())
+    if pin and not hasattr(os, "sched_setaffinity"):
+        raise click.UsageError("--pin is not supported on this platform")
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if jobs is None:
+        jobs = workers = len(cpus)
+    slots = Slots([cpus[i % len(cpus)] for i in range(jobs)], pin)
+
+    history = History(
+        config.get("history", DEFAULT_HISTORY), "time" if timing else "run"
+    )
 
-        # Collect results and print CSV.
-        writer = csv.writer(sys.stdout)
-        writer.writerow(["benchmark", "run", "result"])
+    journal = Journal(config.get("journal", DEFAULT_JOURNAL), resume)
+    runs = list(config["runs"])
+    pipelines = {name: run["pipeline"] for name, run in config["runs"].items()}
+
+    def keys(fn):
+        # Make a function that gives the journal key of each run of a
+        # benchmark.
+        with open(fn, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        return lambda name: journal_key(
+            digest,
+            pipelines[name],
+            pipelines[runs[0]],
+            config["extract"],
+            timeout,
+            counts[name] if timing else None,
+        )
+
+    # Look up the rows that a previous sweep already finished.
+    done = {}
+    if resume:
         for fn in files:
-            first_out = None
-            for name in config["runs"]:
-                try:
-                    stdout, stderr = futs[(fn, name)].result()
-                except subprocess.TimeoutExpired:
-                    stdout, stderr = "", ""
-                    status = "timeout"
-                else:
-                    status = None
-
-                # Check correctness.
-                if first_out is None:
-                    first_out = stdout
-                elif stdout != first_out and not status:
-                    status = "incorrect"
-
-                # Extract the figure of merit.
-                result = get_result([stdout, stderr], config["extract"])
-                if not result and not status:
-                    status = "missing"
-
-                # Report the result.
-                bench, _ = os.path.splitext(os.path.basename(fn))
-                row = [bench, name, status if status else result]
-                writer.writerow(row)
-                rows.append(row)
+            key = keys(fn)
+            for name in runs:
+                row = journal.get(fn, name, key(name))
+                if row is not None:
+                    done[fn, name] = row
+
+    def sweep(fn, names):
+        # Run some of a benchmark's runs, and log their rows as soon as
+        # they are done. Only report the rows that are not already done.
+        todo = {name: pipelines[name] for name in names}
+        if timing:
+            outs, timings = time_bench(
+                todo, fn, timeout, {name: counts[name] for name in names},
+                slots, history,
+            )
+        else:
+            outs = run_bench(todo, fn, timeout, cache, slots, history)
+            timings = None
+        rows = bench_rows(fn, names, outs, timings, config["extract"])
+        rows = {
+            name: row for name, row in rows.items() if (fn, name) not in done
+        }
+        journal.add(fn, rows, keys(fn))
+        return rows
+
+    writer = csv.writer(sys.stdout)
+    header = ["benchmark", "run", "result"]
+    writer.writerow(header + TIMING_COLUMNS if timing else header)
+    sys.stdout.flush()
+
+    # Print the rows in file order, as soon as all the rows for a file and
+    # the files before it are done.
+    printed = 0
+
+    def print_ready():
+        nonlocal printed
+        while printed < len(files) and all(
+            (files[printed], name) in done for name in runs
+        ):
+            for name in runs:
+                writer.writerow(done[files[printed], name])
+            printed += 1
+        sys.stdout.flush()
+
+    pool = futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        # Submit jobs: one per benchmark, so the runs can share the
+        # commands at the start of their pipelines. Start the ones that
+        # took the longest last time first, so a slow benchmark does not
+        # hold up the end of the sweep. Skip the runs that are already
+        # done, except that we always need the first run to check the
+        # others' output.
+        futs = {}
+        for fn in history.order(files):
+            names = [
+                name for i, name in enumerate(runs)
+                if i == 0 or (fn, name) not in done
+            ]
+            if len(names) == 1 and (fn, names[0]) in done:
+                continue
+            futs[pool.submit(sweep, fn, names)] = fn
+
+        print_ready()
+        for fut in futures.as_completed(futs):
+            for name, row in fut.result().items():
+                done[futs[fut], name] = row
+            print_ready()
+        pool.shutdown()
+    except BaseException as exc:
+        # Drop the benchmarks that have not started and kill the ones that
+        # have. The rows that finished are already in the journal.
+        pool.shutdown(wait=False, cancel_futures=True)
+        stop_all()
+        if isinstance(exc, KeyboardInterrupt):
+            print("Interrupted. Use --resume to continue.", file=sys.stderr)
+            sys.exit(130)
+        raise
+    finally:
+        journal.close()
+        history.save()
 
     if plot:
         import matplotlib.pyplot as plt
@@ -144,8 +970,10 @@ def brench(config_path, files, jobs, plot):
         # Group the rows
         # {kind: {benchmark: result}}
         data = {}
-        for bench, kind, result in rows:
-            data.setdefault(kind, {})[bench] = parse(result)
+        for fn in files:
+            for kind in runs:
+                bench, _, result = done[fn, kind][:3]
+                data.setdefault(kind, {})[bench] = parse(result)
 
         # Sort the benchmarks by the first kind
         benchmark_names = list(list(data.values())[0].keys())
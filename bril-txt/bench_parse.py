@@ -0,0 +1,71 @@
+"""Compare the speed of the `bril2json` parser backends.
+
+For every Bril file matching the given glob patterns (by default, all of
+`benchmarks/`), time the Lark-based `parse_bril` and the streaming
+`dump_bril_stream` backend, check that they produce identical output, and
+emit a CSV of the best time (in milliseconds) for each.
+"""
+
+import csv
+import glob
+import io
+import os
+import sys
+import time
+
+import briltxt
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'benchmarks', '**', '*.bril')
+REPEAT = 5
+
+
+def best_time(func):
+    """Run `func` several times and return its fastest time in ms along
+    with its (last) result.
+    """
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        res = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, res
+
+
+def stream(txt):
+    out = io.StringIO()
+    briltxt.dump_bril_stream(io.StringIO(txt), out)
+    return out.getvalue()
+
+
+def bench_parse(patterns):
+    # Warm up the parser cache so we don't count grammar analysis.
+    briltxt.get_parser('lalr')
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['benchmark', 'lines', 'lark', 'stream', 'speedup'])
+    totals = [0.0, 0.0]
+    files = {f for p in patterns for f in glob.glob(p, recursive=True)}
+    for fn in sorted(files):
+        with open(fn) as f:
+            txt = f.read()
+        lark_ms, lark_out = best_time(lambda: briltxt.parse_bril(txt))
+        stream_ms, stream_out = best_time(lambda: stream(txt))
+        if lark_out != stream_out:
+            print('output mismatch: {}'.format(fn), file=sys.stderr)
+            sys.exit(1)
+
+        totals[0] += lark_ms
+        totals[1] += stream_ms
+        bench, _ = os.path.splitext(os.path.basename(fn))
+        writer.writerow([bench, txt.count('\n'), '{:.2f}'.format(lark_ms),
+                         '{:.2f}'.format(stream_ms),
+                         '{:.2f}'.format(lark_ms / stream_ms)])
+    writer.writerow(['total', '', '{:.2f}'.format(totals[0]),
+                     '{:.2f}'.format(totals[1]),
+                     '{:.2f}'.format(totals[0] / totals[1])])
+
+
+if __name__ == '__main__':
+    bench_parse(sys.argv[1:] or [BENCHMARKS])
@@ -9,6 +9,8 @@ format and emits the ordinary JSON representation.
 
 import lark
 import sys
+import os
+import re
 import json
 
 __version__ = '0.0.1'
@@ -22,7 +24,7 @@ start: (struct | func)*
 struct: STRUCT IDENT "=" "{" mbr* "}"
 mbr: IDENT ":" type ";"
 
-func: FUNC ["(" arg_list? ")"] [tyann] "{" instr* "}"
+func: FUNC ["(" arg_list ")"] [tyann] "{" instr* "}"
 arg_list: | arg ("," arg)*
 arg: IDENT ":" type
 ?instr: const | vop | eop | label
@@ -230,17 +232,319 @@ class JSONTransformer(lark.Transformer):
         return value
 
 
-def parse_bril(txt, include_pos=False):
+# Compiled parsers, keyed by algorithm and position mode. Building a
+# parser means analyzing the grammar, so we do it at most once per process.
+_parsers = {}
+
+
+def get_parser(algorithm='lalr', include_pos=False):
+    """Get a (cached) Lark parser for the Bril text format.
+
+    The `lalr` parser is deterministic and applies `JSONTransformer` while
+    parsing, so `parse` returns the JSON data directly without building a
+    parse tree. Its tables are also cached on disk (in the location given
+    by the `BRILTXT_CACHE` environment variable, or a temporary directory
+    by default) so new processes can skip grammar analysis. The `earley`
+    parser is the slower, general fallback: it returns a parse tree.
+    """
+    key = (algorithm, include_pos if algorithm == 'lalr' else False)
+    if key not in _parsers:
+        if algorithm == 'lalr':
+            _parsers[key] = lark.Lark(
+                GRAMMAR,
+                parser='lalr',
+                maybe_placeholders=True,
+                transformer=JSONTransformer(include_pos),
+                cache=os.environ.get('BRILTXT_CACHE', True),
+            )
+        elif algorithm == 'earley':
+            _parsers[key] = lark.Lark(GRAMMAR, maybe_placeholders=True)
+        else:
+            raise ValueError('unknown parser algorithm {}'.format(algorithm))
+    return _parsers[key]
+
+
+def parse_bril(txt, include_pos=False, algorithm='lalr'):
     """Parse a Bril program and return a JSON string.
 
-    Optionally include source position information.
+    Optionally include source position information. By default, use the
+    fast LALR parser and fall back to the Earley parser for input that it
+    rejects; pass `algorithm='earley'` to use Earley unconditionally.
     """
-    parser = lark.Lark(GRAMMAR, maybe_placeholders=True)
-    tree = parser.parse(txt)
-    data = JSONTransformer(include_pos).transform(tree)
+    if algorithm == 'lalr':
+        try:
+            data = get_parser('lalr', include_pos).parse(txt)
+        except lark.exceptions.UnexpectedInput:
+            algorithm = 'earley'
+    if algorithm != 'lalr':
+        tree = get_parser(algorithm).parse(txt)
+        data = JSONTransformer(include_pos).transform(tree)
     return json.dumps(data, indent=2, sort_keys=True)
 
 
+# Streaming text format parser. This is a hand-written alternative to the
+# Lark grammar above that produces identical JSON. It scans the input line
+# by line and yields each function as soon as it is complete, so memory use
+# is bounded by the largest function instead of the whole program.
+
+_IDENT = r'[_%A-Za-z][_%.A-Za-z0-9]*'
+_EXP = r'[eE][+-]?[0-9]+'
+_TOKEN_RE = re.compile(r'''
+    (?P<ws>\s+)
+  | (?P<comment>\#.*)
+  | (?P<char>'(?:\\[0abtnvfr]|.)')
+  | (?P<float>[+-]?(?:[0-9]+\.[0-9]*(?:{exp})?|\.[0-9]+(?:{exp})?
+                    |[0-9]+{exp}))
+  | (?P<int>[+-]?[0-9]+)
+  | (?P<func>@{ident})
+  | (?P<label>\.{ident})
+  | (?P<ident>{ident})
+  | (?P<punct>[=;:{{}}()<>,])
+'''.format(ident=_IDENT, exp=_EXP), re.VERBOSE)
+
+
+def scan_bril(lines):
+    """Tokenize Bril text, given as an iterable of lines.
+
+    Generate `(kind, text, row, col)` tuples. The kind is the name of a
+    group in `_TOKEN_RE`; for punctuation, it is the character itself.
+    Keywords like `const` are scanned as identifiers and recognized by the
+    parser.
+    """
+    for row, line in enumerate(lines, 1):
+        pos = 0
+        end = len(line)
+        while pos < end:
+            match = _TOKEN_RE.match(line, pos)
+            if not match:
+                raise ValueError('line {}, column {}: unexpected {!r}'.format(
+                    row, pos + 1, line[pos],
+                ))
+            kind = match.lastgroup
+            if kind == 'punct':
+                kind = match.group()
+            if kind != 'ws' and kind != 'comment':
+                yield kind, match.group(), row, pos + 1
+            pos = match.end()
+
+
+class _StreamParser:
+    """A recursive-descent parser over the tokens from `scan_bril`.
+
+    The methods mirror the rules in `GRAMMAR` and build the same data as
+    `JSONTransformer`.
+    """
+
+    def __init__(self, tokens, include_pos):
+        self.tokens = tokens
+        self.include_pos = include_pos
+        self.lookahead = []
+
+    def peek(self, n=0):
+        while len(self.lookahead) <= n:
+            self.lookahead.append(next(self.tokens, (None, '', None, None)))
+        return self.lookahead[n]
+
+    def take(self, kind=None, text=None):
+        tok = self.peek()
+        if (kind and tok[0] != kind) or (text and tok[1] != text):
+            if tok[0] is None:
+                raise ValueError('unexpected end of input')
+            raise ValueError('line {}, column {}: unexpected {!r}'.format(
+                tok[2], tok[3], tok[1],
+            ))
+        self.lookahead.pop(0)
+        return tok
+
+    def pos(self, tok):
+        return {'row': tok[2], 'col': tok[3]}
+
+    def start(self):
+        while self.peek()[0] is not None:
+            if self.peek()[0] == 'func':
+                yield self.func()
+            else:
+                yield self.struct()
+
+    def struct(self):
+        self.take('ident', 'struct')
+        name = self.take('ident')[1]
+        self.take('=')
+        self.take('{')
+        mbrs = []
+        while self.peek()[0] != '}':
+            mbrs.append(self.name_type())
+            self.take(';')
+        self.take('}')
+        return {
+            'name': name,
+            'mbrs': mbrs,
+        }
+
+    def func(self):
+        name = self.take('func')
+        func = {'name': name[1][1:]}  # Strip `@`.
+        if self.peek()[0] == '(':
+            self.take('(')
+            args = []
+            if self.peek()[0] != ')':
+                args.append(self.name_type())
+                while self.peek()[0] == ',':
+                    self.take(',')
+                    args.append(self.name_type())
+            self.take(')')
+            if args:
+                func['args'] = args
+        if self.peek()[0] == ':':
+            self.take(':')
+            func['type'] = self.type()
+        self.take('{')
+        instrs = []
+        while self.peek()[0] != '}':
+            instrs.append(self.instr())
+        self.take('}')
+        func['instrs'] = instrs
+        if self.include_pos:
+            func['pos'] = self.pos(name)
+        return func
+
+    def name_type(self):
+        name = self.take('ident')[1]
+        self.take(':')
+        return {
+            'name': name,
+            'type': self.type(),
+        }
+
+    def type(self):
+        name = self.take('ident')[1]
+        if self.peek()[0] == '<':
+            self.take('<')
+            param = self.type()
+            self.take('>')
+            return {name: param}
+        return name
+
+    def instr(self):
+        first = self.peek()
+        if first[0] == 'label':
+            self.take('label')
+            self.take(':')
+            out = {'label': first[1][1:]}  # Strip `.`.
+            if self.include_pos:
+                out['pos'] = self.pos(first)
+            return out
+
+        if self.peek(1)[0] not in (':', '='):
+            # An effect operation.
+            out = self.op()
+            self.take(';')
+            return out
+
+        dest = self.take('ident')
+        out = {'dest': dest[1]}
+        if self.peek()[0] == ':':
+            self.take(':')
+            out['type'] = self.type()
+        self.take('=')
+        lit = self.peek(1)
+        if self.peek()[1] == 'const' and (
+            lit[0] in ('int', 'float', 'char') or
+            lit[1] in ('true', 'false', 'nullptr')
+        ):
+            self.take()
+            self.take()
+            out['op'] = 'const'
+            out['value'] = self.lit(lit)
+        else:
+            out.update(self.op())
+        self.take(';')
+        if self.include_pos:
+            out['pos'] = self.pos(dest)
+        return out
+
+    def op(self):
+        op_token = self.take('ident')
+        funcs = []
+        labels = []
+        args = []
+        while True:
+            kind, text, _, _ = self.peek()
+            if kind == 'func':
+                funcs.append(text[1:])
+            elif kind == 'label':
+                labels.append(text[1:])
+            elif kind == 'ident':
+                args.append(text)
+            else:
+                break
+            self.take()
+
+        out = {'op': op_token[1]}
+        if args:
+            out['args'] = args
+        if funcs:
+            out['funcs'] = funcs
+        if labels:
+            out['labels'] = labels
+        if self.include_pos:
+            out['pos'] = self.pos(op_token)
+        return out
+
+    def lit(self, tok):
+        kind, text, _, _ = tok
+        if kind == 'int':
+            return int(text)
+        elif kind == 'float':
+            return float(text)
+        elif kind == 'char':
+            value = text[1:-1]  # Strip `'`.
+            if value in control_chars:
+                return chr(control_chars[value])
+            return value
+        elif text == 'nullptr':
+            return 0
+        else:
+            return text == 'true'
+
+
+def parse_bril_stream(lines, include_pos=False):
+    """Parse Bril text, given as an iterable of lines, without Lark.
+
+    Generate the top-level struct and function objects in source order, as
+    soon as each one is complete. Structs can be distinguished from
+    functions by their `mbrs` key.
+    """
+    parser = _StreamParser(scan_bril(lines), include_pos)
+    return parser.start()
+
+
+def dump_bril_stream(lines, out, include_pos=False):
+    """Parse Bril text, given as an iterable of lines, and write the JSON
+    representation to the file `out` one function at a time.
+
+    The output is identical to the string that `parse_bril` returns.
+    """
+    structs = []
+    first = True
+    out.write('{\n  "functions": [')
+    for item in parse_bril_stream(lines, include_pos):
+        if 'mbrs' in item:
+            # Structs sort after functions, so save them for the end.
+            structs.append(item)
+            continue
+        out.write('\n    ' if first else ',\n    ')
+        out.write(json.dumps(item, indent=2, sort_keys=True)
+                  .replace('\n', '\n    '))
+        first = False
+    out.write(']' if first else '\n  ]')
+    if structs:
+        out.write(',\n  "structs": ')
+        out.write(json.dumps(structs, indent=2, sort_keys=True)
+                  .replace('\n', '\n  '))
+    out.write('\n}')
+
+
 # Text format pretty-printer.
 
 def type_to_str(type):
@@ -295,6 +599,45 @@ def instr_to_string(instr):
             return rhs
 
 
+def _fast_instr_to_string(instr):
+    """Like `instr_to_string`, but with a fast path for the most common
+    instruction shapes: simple-typed constants and operations that only
+    have variable arguments.
+    """
+    op = instr['op']
+    typ = instr.get('type')
+    if isinstance(typ, dict) or 'funcs' in instr or 'labels' in instr:
+        return instr_to_string(instr)
+    if op == 'const':
+        if typ != 'int' and typ != 'bool':
+            return instr_to_string(instr)
+        return '{}: {} = const {}'.format(
+            instr['dest'], typ, str(instr['value']).lower(),
+        )
+
+    args = instr.get('args')
+    rhs = '{} {}'.format(op, ' '.join(args)) if args else op
+    if 'dest' not in instr:
+        return rhs
+    elif typ is None:
+        return '{} = {}'.format(instr['dest'], rhs)
+    else:
+        return '{}: {} = {}'.format(instr['dest'], typ, rhs)
+
+
+def instrs_to_string(instrs, indent='  ', end=';', sep='\n'):
+    """Format a list of instructions and labels as a single string.
+
+    Each instruction is prefixed with `indent` and followed by `end`;
+    labels are printed as `.name:`. The lines are joined with `sep`.
+    """
+    return sep.join(
+        '.{}:'.format(i['label']) if 'label' in i
+        else indent + _fast_instr_to_string(i) + end
+        for i in instrs
+    )
+
+
 def print_instr(instr):
     print('  {};'.format(instr_to_string(instr)))
 
@@ -313,22 +656,33 @@ def args_to_string(args):
         return ''
 
 
-def print_func(func):
+def func_to_string(func):
+    """Format a function in the text format, including a trailing newline.
+    """
     typ = func.get('type', 'void')
-    print('@{}{}{} {{'.format(
+    lines = ['@{}{}{} {{'.format(
         func['name'],
         args_to_string(func.get('args', [])),
         ': {}'.format(type_to_str(typ)) if typ != 'void' else '',
-    ))
-    for instr_or_label in func['instrs']:
-        if 'label' in instr_or_label:
-            print_label(instr_or_label)
-        else:
-            print_instr(instr_or_label)
-    print('}')
+    )]
+    if func['instrs']:
+        lines.append(instrs_to_string(func['instrs']))
+    lines.append('}\n')
+    return '\n'.join(lines)
+
+
+def program_to_string(prog):
+    """Format all the functions in a program in the text format.
+    """
+    return ''.join(func_to_string(func) for func in prog['functions'])
+
+
+def print_func(func):
+    sys.stdout.write(func_to_string(func))
 
 
 def print_prog(prog):
+    # Write one buffer per function instead of one line at a time.
     for func in prog['functions']:
         print_func(func)
 
@@ -336,7 +690,16 @@ def print_prog(prog):
 # Command-line entry points.
 
 def bril2json():
-    print(parse_bril(sys.stdin.read(), '-p' in sys.argv[1:]))
+    include_pos = '-p' in sys.argv[1:]
+    if '-s' in sys.argv[1:]:
+        dump_bril_stream(sys.stdin, sys.stdout, include_pos)
+        print()
+    else:
+        print(parse_bril(
+            sys.stdin.read(),
+            include_pos,
+            'earley' if '-e' in sys.argv[1:] else 'lalr',
+        ))
 
 
 def bril2txt():
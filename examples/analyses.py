@@ -0,0 +1,162 @@
+"""Memoized, per-function analyses that can be shared between passes.
+
+An `AnalysisManager` computes each analysis for a function on demand and
+remembers the result until a transformation invalidates it. Analyses may
+depend on each other; for example, `dom` uses `succ`, which uses `cfg`.
+"""
+import cfg
+import defuse
+import df
+import dom
+import from_ssa
+from form_blocks import form_blocks
+
+
+def _blocks(fa):
+    blocks = cfg.block_map(form_blocks(fa.func['instrs']))
+    cfg.add_terminators(blocks)
+    return blocks
+
+
+def _cfg(fa):
+    blocks = cfg.block_map(form_blocks(fa.func['instrs']))
+    cfg.add_entry(blocks)
+    cfg.add_terminators(blocks)
+    return blocks
+
+
+def _rpo(fa):
+    graph = fa['compact']
+    return [graph.labels[i] for i in reversed(graph.postorder())]
+
+
+# Each analysis is a function that takes the `FunctionAnalyses` for a
+# function (to look up the function and any other analyses it needs) and
+# returns the result.
+ANALYSES = {
+    # The basic blocks, with terminators, as a `cfg.block_map`.
+    'blocks': _blocks,
+
+    # `blocks` as a `cfg.CompactCFG`, and its immediate dominators. The
+    # first block is the entry even if it has predecessors.
+    'blocks_compact': lambda fa: cfg.CompactCFG.from_block_map(fa['blocks']),
+    'blocks_idom': lambda fa: dom.Dominators(fa['blocks_compact']),
+
+    # Like `blocks`, but with a unique entry block that has no
+    # predecessors (via `cfg.add_entry`).
+    'cfg': _cfg,
+
+    # `cfg` as a `cfg.CompactCFG`.
+    'compact': lambda fa: cfg.CompactCFG.from_block_map(fa['cfg']),
+
+    # Successor and predecessor maps for `cfg`.
+    'succ': lambda fa: fa['compact'].edges()[1],
+    'preds': lambda fa: fa['compact'].edges()[0],
+
+    # The block names in reverse postorder.
+    'rpo': _rpo,
+
+    # Immediate dominators, as a `dom.Dominators`.
+    'idom': lambda fa: dom.Dominators(fa['compact']),
+
+    # Dominators, the dominance frontier, and the dominator tree.
+    'dom': lambda fa: fa['idom'].sets(),
+    'dom_fronts': lambda fa: fa['idom'].fronts(),
+    'dom_tree': lambda fa: fa['idom'].tree(),
+
+    # The definitions and uses of each variable in `blocks`, as a
+    # `defuse.DefUse`. A pass that edits the blocks through it must still
+    # invalidate the other analyses.
+    'defuse': lambda fa: defuse.DefUse(fa['blocks']),
+
+    # Live variables, as the `(in, out)` maps from `df.df_worklist`.
+    'live': lambda fa: fa.dataflow(df.ANALYSES['live']),
+
+    # Live variables in `blocks` for a function with phi-nodes, as the
+    # `(in, out)` maps from `from_ssa.ssa_liveness`.
+    'ssa_live': lambda fa: from_ssa.ssa_liveness(fa['blocks'],
+                                                 fa['blocks_compact']),
+}
+
+# The analyses of `blocks` itself. A transformation that keeps the cached
+# blocks in sync with the instructions it writes back (and leaves the
+# labels and terminators alone) preserves these. The `cfg` analyses can
+# still change, since removing a phi-node that mentions the first block
+# changes whether `cfg.add_entry` adds a new entry.
+BLOCK_ANALYSES = frozenset(['blocks', 'blocks_compact', 'blocks_idom'])
+
+
+class FunctionAnalyses:
+    """The memoized analysis results for a single function.
+
+    Look up an analysis by name with `fa[name]`.
+    """
+
+    def __init__(self, func, manager=None):
+        self.func = func
+        self.manager = manager
+        self._results = {}
+
+    def _get(self, key, compute):
+        if key not in self._results:
+            self._results[key] = compute()
+            if self.manager is not None:
+                self.manager.computed += 1
+        return self._results[key]
+
+    def __getitem__(self, name):
+        return self._get(name, lambda: ANALYSES[name](self))
+
+    def dataflow(self, analysis):
+        """Get the `(in, out)` result of a `df.Analysis` over `blocks`.
+        """
+        return self._get(('dataflow', id(analysis)),
+                         lambda: df.df_worklist(self['blocks_compact'],
+                                                analysis))
+
+    def invalidate(self, preserved=()):
+        """Forget every result except the named analyses in `preserved`.
+        """
+        for key in list(self._results):
+            if key not in preserved:
+                del self._results[key]
+
+    def rebase(self, renamed):
+        """Forget every result except the ones named by the keys of
+        `renamed`, which are kept under the names they map to. This is for
+        transformations that turn one analysis's result into another's:
+        for example, a function reassembled from the blocks of `cfg` has
+        those blocks as its `blocks`.
+        """
+        self._results = {new: self._results[old]
+                         for old, new in renamed.items()
+                         if old in self._results}
+
+
+class AnalysisManager:
+    """Memoized analyses for all the functions in a program, keyed by
+    function name.
+
+    `computed` counts the analyses that have actually been run (i.e., not
+    served from the cache).
+    """
+
+    def __init__(self):
+        self._funcs = {}
+        self.computed = 0
+
+    def get(self, func):
+        """Get the `FunctionAnalyses` for a function.
+        """
+        fa = self._funcs.get(func['name'])
+        if fa is None or fa.func is not func:
+            fa = FunctionAnalyses(func, self)
+            self._funcs[func['name']] = fa
+        return fa
+
+    def invalidate(self, func, preserved=()):
+        """Invalidate the analyses for a function that a transformation
+        has changed, except for the ones it preserves.
+        """
+        if func['name'] in self._funcs:
+            self._funcs[func['name']].invalidate(preserved)
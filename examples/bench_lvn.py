@@ -0,0 +1,64 @@
+"""Measure how local value numbering scales with basic block length.
+
+Generate long, synthetic straight-line blocks (like the ones loop
+unrolling produces) that reuse a small pool of variable names, so most
+instructions clobber an earlier value, and emit a CSV of the best time
+to run `lvn.lvn_block` (with propagation, canonicalization, and folding)
+on each. The time per instruction should stay flat as blocks grow.
+
+    python3 bench_lvn.py [SIZE ...]
+"""
+import csv
+import random
+import sys
+import time
+
+import lvn
+
+SIZES = [1000, 2000, 4000, 8000, 16000, 32000]
+NVARS = 64
+REPEAT = 3
+
+
+def gen_block(size, nvars=NVARS, seed=0):
+    """Generate a straight-line block of `size` instructions over `nvars`
+    variables. The variables start out as inputs to the block (not
+    constants, which would fold into ever-larger numbers).
+    """
+    rng = random.Random(seed)
+    names = ['v{}'.format(i) for i in range(nvars)]
+    block = []
+    while len(block) < size:
+        op = rng.choice(['add', 'mul', 'sub', 'id'])
+        args = rng.sample(names, 1 if op == 'id' else 2)
+        block.append({'op': op, 'dest': rng.choice(names), 'type': 'int',
+                      'args': args})
+    block.append({'op': 'print', 'args': names})
+    return block
+
+
+def time_lvn(size):
+    """Return the best time, in ms, to run LVN on a block of `size`
+    instructions.
+    """
+    best = None
+    for _ in range(REPEAT):
+        block = gen_block(size)
+        start = time.perf_counter()
+        lvn.lvn_block(block, lvn._lookup, lvn._canonicalize, lvn._fold)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def bench_lvn(sizes):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['instrs', 'ms', 'us/instr'])
+    for size in sizes:
+        ms = time_lvn(size)
+        writer.writerow([size, '{:.2f}'.format(ms),
+                         '{:.2f}'.format(ms * 1000 / size)])
+
+
+if __name__ == '__main__':
+    bench_lvn([int(a) for a in sys.argv[1:]] or SIZES)
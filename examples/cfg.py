@@ -1,3 +1,4 @@
+from array import array
 from collections import OrderedDict
 from util import fresh, flatten
 from form_blocks import TERMINATORS
@@ -66,6 +67,23 @@ def add_terminators(blocks):
                 block.append({'op': 'jmp', 'labels': [dest]})
 
 
+def drop_fallthroughs(blocks):
+    """Remove the terminators that `add_terminators` would add back: jumps
+    to the next block and an argument-less return at the very end.
+    """
+    names = list(blocks)
+    for name, next_name in zip(names, names[1:] + [None]):
+        block = blocks[name]
+        if not block:
+            continue
+        term = block[-1]
+        if term['op'] == 'jmp' and term['labels'] == [next_name]:
+            block.pop()
+        elif (next_name is None and term['op'] == 'ret'
+              and not term.get('args')):
+            block.pop()
+
+
 def add_entry(blocks):
     """Ensure that a CFG has a unique entry block with no predecessors.
 
@@ -111,3 +129,116 @@ def reassemble(blocks):
         instrs.append({'label': name})
         instrs += block
     return instrs
+
+
+class CompactCFG:
+    """A control-flow graph with integer block ids.
+
+    Blocks are numbered from 0 in block-map order, so block 0 is the
+    entry. `labels[i]` is the name of block `i` and `ids` maps names back
+    to numbers. The edges are stored in compressed sparse row form: the
+    successors of block `i` are `succ_targets[succ_offsets[i]:
+    succ_offsets[i + 1]]`, and likewise for predecessors. This avoids
+    hashing label strings in the inner loops of analyses and uses much
+    less memory than dicts of lists for large functions.
+    """
+
+    def __init__(self, labels, blocks, succ_offsets, succ_targets):
+        self.labels = labels
+        self.ids = {name: i for i, name in enumerate(labels)}
+        self.blocks = blocks
+        self.succ_offsets = succ_offsets
+        self.succ_targets = succ_targets
+
+        # Build the predecessor arrays with a counting sort over the
+        # successor edges.
+        n = len(labels)
+        counts = array('l', [0]) * (n + 1)
+        for t in succ_targets:
+            counts[t + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        self.pred_offsets = array('l', counts)
+        self.pred_targets = array('l', [0]) * len(succ_targets)
+        for src in range(n):
+            for j in range(succ_offsets[src], succ_offsets[src + 1]):
+                t = succ_targets[j]
+                self.pred_targets[counts[t]] = src
+                counts[t] += 1
+
+    @classmethod
+    def from_block_map(cls, blocks):
+        """Build a compact CFG from a block map whose blocks all have
+        terminators (see `add_terminators`).
+        """
+        labels = list(blocks.keys())
+        ids = {name: i for i, name in enumerate(labels)}
+        succ_offsets = array('l', [0])
+        succ_targets = array('l')
+        for block in blocks.values():
+            succ_targets.extend(ids[s] for s in successors(block[-1]))
+            succ_offsets.append(len(succ_targets))
+        return cls(labels, list(blocks.values()), succ_offsets, succ_targets)
+
+    @classmethod
+    def from_succ(cls, succ):
+        """Build a compact CFG from a successor edge map alone. The blocks
+        are all None.
+        """
+        labels = list(succ.keys())
+        ids = {name: i for i, name in enumerate(labels)}
+        succ_offsets = array('l', [0])
+        succ_targets = array('l')
+        for ss in succ.values():
+            succ_targets.extend(ids[s] for s in ss)
+            succ_offsets.append(len(succ_targets))
+        return cls(labels, [None] * len(labels), succ_offsets, succ_targets)
+
+    def to_block_map(self):
+        """Convert back to an `OrderedDict` block map. The blocks are
+        shared, not copied.
+        """
+        return OrderedDict(zip(self.labels, self.blocks))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def succs(self, i):
+        """The successor ids of block `i`."""
+        return self.succ_targets[self.succ_offsets[i]:
+                                 self.succ_offsets[i + 1]]
+
+    def preds(self, i):
+        """The predecessor ids of block `i`."""
+        return self.pred_targets[self.pred_offsets[i]:
+                                 self.pred_offsets[i + 1]]
+
+    def edges(self):
+        """Produce label-based predecessor and successor maps, like
+        `edges`.
+        """
+        labels = self.labels
+        preds = {name: [labels[p] for p in self.preds(i)]
+                 for i, name in enumerate(labels)}
+        succs = {name: [labels[s] for s in self.succs(i)]
+                 for i, name in enumerate(labels)}
+        return preds, succs
+
+    def postorder(self, root=0):
+        """List the ids of the blocks reachable from `root` in postorder.
+        """
+        explored = bytearray(len(self.labels))
+        explored[root] = 1
+        out = []
+        stack = [(root, iter(self.succs(root)))]
+        while stack:
+            node, it = stack[-1]
+            for s in it:
+                if not explored[s]:
+                    explored[s] = 1
+                    stack.append((s, iter(self.succs(s))))
+                    break
+            else:
+                stack.pop()
+                out.append(node)
+        return out
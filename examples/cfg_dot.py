@@ -28,7 +28,8 @@ def cfg_dot(bril, verbose):
                 print(r'  {} [shape=box, xlabel="{}", label="{}\l"];'.format(
                     quote_if_needed(name),
                     name,
-                    r'\l'.join(briltxt.instr_to_string(i) for i in block),
+                    briltxt.instrs_to_string(block, indent='', end='',
+                                             sep=r'\l'),
                 ))
             else:
                 print('  {};'.format(name))
@@ -0,0 +1,191 @@
+"""An index of the definitions and uses of variables in a function.
+
+Passes that need to know where a variable is defined or used can build a
+`DefUse` once (or get it from `analyses.py`) instead of rescanning the
+instructions, and keep it up to date as they delete, insert, and rewrite
+instructions.
+"""
+import json
+import sys
+from array import array
+from collections import Counter
+
+import cfg
+from form_blocks import form_blocks
+
+
+class DefUse:
+    """The definitions and uses of every variable in a block map.
+
+    Positions are `(block, index)` pairs, where `block` is a block name and
+    `index` is the instruction's position in that block. Internally, each
+    instruction gets a stable integer id, and each variable maps to
+    compact arrays of the ids that define and use it; an id's position is
+    kept in two more arrays. Making changes through the index (not by
+    editing the blocks directly) keeps it consistent with the blocks,
+    which it shares. Edits only touch the changed block.
+    """
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self._names = list(blocks.keys())
+        self._block_nums = {name: i for i, name in enumerate(self._names)}
+
+        # Per instruction id: the instruction, its block number and index,
+        # and whether it is still in the function.
+        self._instrs = []
+        self._block = array('l')
+        self._index = array('l')
+        self._alive = bytearray()
+
+        # The ids in each block, in order.
+        self._order = {name: [] for name in self._names}
+
+        # Per variable: arrays of the ids that define or use it (including
+        # deleted ids, which are filtered out lazily), and live counts.
+        self._defs = {}
+        self._uses = {}
+        self._num_defs = Counter()
+        self._num_uses = Counter()
+
+        for name, block in blocks.items():
+            order = self._order[name]
+            for index, instr in enumerate(block):
+                order.append(self._add(instr, self._block_nums[name],
+                                       index))
+
+    def _add(self, instr, block_num, index):
+        # Give an instruction a new id and index its variables.
+        i = len(self._instrs)
+        self._instrs.append(instr)
+        self._block.append(block_num)
+        self._index.append(index)
+        self._alive.append(1)
+        if 'dest' in instr:
+            self._defs.setdefault(instr['dest'], array('l')).append(i)
+            self._num_defs[instr['dest']] += 1
+        for arg in instr.get('args', []):
+            self._uses.setdefault(arg, array('l')).append(i)
+            self._num_uses[arg] += 1
+        return i
+
+    def _remove(self, i):
+        # Mark an id as deleted and update the counts.
+        self._alive[i] = 0
+        instr = self._instrs[i]
+        if 'dest' in instr:
+            self._num_defs[instr['dest']] -= 1
+        for arg in instr.get('args', []):
+            self._num_uses[arg] -= 1
+
+    def _positions(self, table, var):
+        ids = table.get(var)
+        if not ids:
+            return []
+        live = [i for i in ids if self._alive[i]]
+        if len(live) != len(ids):
+            table[var] = array('l', live)
+        return [(self._names[self._block[i]], self._index[i]) for i in live]
+
+    def _renumber(self, name, start):
+        # Fix the indices in a block after an insertion or deletion.
+        order = self._order[name]
+        for index in range(start, len(order)):
+            self._index[order[index]] = index
+
+    def defs(self, var):
+        """The positions of the instructions that assign to `var`.
+        """
+        return self._positions(self._defs, var)
+
+    def uses(self, var):
+        """The positions of the instructions that read `var`. An
+        instruction that reads it more than once appears more than once.
+        """
+        return self._positions(self._uses, var)
+
+    def num_defs(self, var):
+        """The number of instructions that assign to `var`."""
+        return self._num_defs[var]
+
+    def num_uses(self, var):
+        """The number of times `var` is read."""
+        return self._num_uses[var]
+
+    def variables(self):
+        """All the variables that are defined or used.
+        """
+        return {v for v, n in self._num_defs.items() if n} | \
+            {v for v, n in self._num_uses.items() if n}
+
+    def delete(self, block, index):
+        """Delete the instruction at a position and return it.
+        """
+        i = self._order[block].pop(index)
+        self._remove(i)
+        del self.blocks[block][index]
+        self._renumber(block, index)
+        return self._instrs[i]
+
+    def insert(self, block, index, instr):
+        """Insert an instruction before the given position.
+        """
+        i = self._add(instr, self._block_nums[block], index)
+        self._order[block].insert(index, i)
+        self.blocks[block].insert(index, instr)
+        self._renumber(block, index + 1)
+
+    def replace(self, block, index, instr):
+        """Replace the instruction at a position (for example, with a copy
+        that has different arguments). The new instruction must be a
+        different object from the old one, which is returned.
+        """
+        order = self._order[block]
+        old = order[index]
+        self._remove(old)
+        order[index] = self._add(instr, self._block[old], index)
+        self.blocks[block][index] = instr
+        return self._instrs[old]
+
+    def rename(self, var, new):
+        """Rename a variable everywhere it is defined or used.
+        """
+        if new == var:
+            return
+        def_ids = [i for i in self._defs.pop(var, ()) if self._alive[i]]
+        use_ids = [i for i in self._uses.pop(var, ()) if self._alive[i]]
+        self._defs.setdefault(new, array('l')).extend(def_ids)
+        self._uses.setdefault(new, array('l')).extend(use_ids)
+        self._num_defs[new] += self._num_defs.pop(var, 0)
+        self._num_uses[new] += self._num_uses.pop(var, 0)
+
+        for i in def_ids:
+            self._instrs[i]['dest'] = new
+        for i in dict.fromkeys(use_ids):
+            instr = self._instrs[i]
+            instr['args'] = [new if a == var else a for a in instr['args']]
+
+
+def _fmt(positions):
+    if positions:
+        return ', '.join('{}[{}]'.format(b, i) for b, i in positions)
+    else:
+        return '∅'
+
+
+def print_defuse(bril):
+    """Print the definitions and uses of every variable in each function.
+    """
+    for func in bril['functions']:
+        blocks = cfg.block_map(form_blocks(func['instrs']))
+        cfg.add_terminators(blocks)
+        index = DefUse(blocks)
+        print('@{}:'.format(func['name']))
+        for var in sorted(index.variables()):
+            print('  {}:'.format(var))
+            print('    defs:', _fmt(index.defs(var)))
+            print('    uses:', _fmt(index.uses(var)))
+
+
+if __name__ == '__main__':
+    print_defuse(json.load(sys.stdin))
@@ -1,6 +1,9 @@
 import sys
 import json
-from collections import namedtuple
+import heapq
+import functools
+import operator
+from collections import namedtuple, deque
 
 from form_blocks import form_blocks
 import cfg
@@ -10,7 +13,19 @@ import cfg
 # - init: An initial value (bottom or top of the latice).
 # - merge: Take a list of values and produce a single value.
 # - transfer: The transfer function.
-Analysis = namedtuple('Analysis', ['forward', 'init', 'merge', 'transfer'])
+# - bits: Optionally, a `BitVector` formulation of the same analysis. If
+#   present, the solver uses it instead of `merge` and `transfer`.
+Analysis = namedtuple('Analysis', ['forward', 'init', 'merge', 'transfer',
+                                   'bits'], defaults=[None])
+
+# A "gen/kill" analysis over sets of variable names, where the transfer
+# function is `gen(block) | (in - kill(block))`. The solver numbers the
+# variables once per function and represents each set as a Python int, so
+# merging and transfer become bitwise operations.
+# - gen: Take a block and produce the set of names it generates.
+# - kill: Take a block and produce the set of names it kills.
+# - meet: Either 'union' or 'intersect'.
+BitVector = namedtuple('BitVector', ['gen', 'kill', 'meet'])
 
 
 def union(sets):
@@ -20,46 +35,193 @@ def union(sets):
     return out
 
 
-def df_worklist(blocks, analysis):
-    """The worklist algorithm for iterating a data flow analysis to a
-    fixed point.
+def _bits_to_set(bits, names):
+    """Convert an int bit vector back to a set of names.
     """
-    preds, succs = cfg.edges(blocks)
+    digits = bin(bits)[:1:-1]  # Least significant bit first.
+    return {names[i] for i, d in enumerate(digits) if d == '1'}
 
-    # Switch between directions.
-    if analysis.forward:
-        first_block = list(blocks.keys())[0]  # Entry.
-        in_edges = preds
-        out_edges = succs
+
+def worklist_order(graph, forward):
+    """Choose the order in which the worklist should visit blocks: reverse
+    postorder for forward analyses and postorder for backward ones, so
+    that blocks tend to be visited after the blocks they depend on.
+    Unreachable blocks go last. Produce the order (a list of block ids)
+    and each block's rank in it.
+    """
+    order = graph.postorder()
+    if forward:
+        order.reverse()
+    rank = [-1] * len(graph)
+    for r, node in enumerate(order):
+        rank[node] = r
+    for node in range(len(graph)):
+        if rank[node] < 0:
+            rank[node] = len(order)
+            order.append(node)
+    return order, rank
+
+
+def solve(graph, forward, init, merge, transfer, order='priority',
+          stats=None):
+    """The worklist algorithm for iterating a data flow analysis to a
+    fixed point over a `cfg.CompactCFG`.
+
+    `merge` takes a list of values; `transfer` takes a block id and a
+    value. Produce lists, indexed by block id, of the merged values and
+    the transferred values. (For backward analyses, these are the values
+    at the ends and starts of the blocks, respectively.)
+
+    With the `priority` order, the worklist visits blocks in sweeps in
+    `worklist_order` and never holds a block more than once. The `fifo`
+    order is a plain queue that may hold duplicates. If `stats` is a
+    dict, add the number of blocks visited to `stats['iterations']`.
+    """
+    n = len(graph)
+    if forward:
+        first_block = 0  # Entry.
+        in_edges = graph.preds
+        out_edges = graph.succs
     else:
-        first_block = list(blocks.keys())[-1]  # Exit.
-        in_edges = succs
-        out_edges = preds
+        first_block = n - 1  # Exit.
+        in_edges = graph.succs
+        out_edges = graph.preds
 
     # Initialize.
-    in_ = {first_block: analysis.init}
-    out = {node: analysis.init for node in blocks}
+    in_ = [None] * n
+    if n:
+        in_[first_block] = init
+    out = [init] * n
+    iterations = 0
+
+    if order == 'fifo':
+        worklist = deque(range(n))
+        while worklist:
+            node = worklist.popleft()
+            iterations += 1
+
+            inval = merge([out[p] for p in in_edges(node)])
+            in_[node] = inval
 
-    # Iterate.
-    worklist = list(blocks.keys())
-    while worklist:
-        node = worklist.pop(0)
+            outval = transfer(node, inval)
+
+            if outval != out[node]:
+                out[node] = outval
+                worklist.extend(out_edges(node))
+
+    else:
+        # Sweep over the blocks in rank order. A block that needs another
+        # visit joins the current sweep if it comes later in the order and
+        # waits for the next sweep otherwise (i.e., along back edges). Both
+        # worklists are heaps of ranks; since the blocks start out in rank
+        # order, the initial list is already a valid heap.
+        ordered, rank = worklist_order(graph, forward)
+        worklist = list(range(n))
+        next_worklist = []
+        queued = bytearray(b'\x01') * n
+        while worklist:
+            r = heapq.heappop(worklist)
+            node = ordered[r]
+            queued[node] = 0
+            iterations += 1
 
-        inval = analysis.merge(out[n] for n in in_edges[node])
-        in_[node] = inval
+            inval = merge([out[p] for p in in_edges(node)])
+            in_[node] = inval
 
-        outval = analysis.transfer(blocks[node], inval)
+            outval = transfer(node, inval)
 
-        if outval != out[node]:
-            out[node] = outval
-            worklist += out_edges[node]
+            if outval != out[node]:
+                out[node] = outval
+                for s in out_edges(node):
+                    if not queued[s]:
+                        queued[s] = 1
+                        heapq.heappush(
+                            worklist if rank[s] > r else next_worklist,
+                            rank[s],
+                        )
+
+            if not worklist:
+                worklist, next_worklist = next_worklist, worklist
+
+    if stats is not None:
+        stats['iterations'] = stats.get('iterations', 0) + iterations
+    return in_, out
+
+
+def df_bitvector(graph, analysis, order='priority', stats=None):
+    """Solve an analysis with a `BitVector` formulation over a
+    `cfg.CompactCFG`. Produce lists of in and out values (as sets)
+    indexed by block id.
+    """
+    # Number the variables and precompute gen and kill for every block.
+    names = []
+    index = {}
 
+    def to_bits(vals):
+        bits = 0
+        for v in vals:
+            if v not in index:
+                index[v] = len(names)
+                names.append(v)
+            bits |= 1 << index[v]
+        return bits
+
+    gen = [to_bits(analysis.bits.gen(b)) for b in graph.blocks]
+    kill = [~to_bits(analysis.bits.kill(b)) for b in graph.blocks]
+
+    if analysis.bits.meet == 'union':
+        def merge(vals):
+            return functools.reduce(operator.or_, vals, 0)
+    else:
+        def merge(vals):
+            return functools.reduce(operator.and_, vals) if vals else 0
+
+    in_, out = solve(
+        graph, analysis.forward, to_bits(analysis.init), merge,
+        lambda node, inval: gen[node] | (inval & kill[node]),
+        order, stats,
+    )
+
+    in_ = [_bits_to_set(b, names) for b in in_]
+    out = [_bits_to_set(b, names) for b in out]
     if analysis.forward:
         return in_, out
     else:
         return out, in_
 
 
+def df_worklist_compact(graph, analysis, order='priority', stats=None):
+    """Solve a data flow analysis over a `cfg.CompactCFG`. Produce lists
+    of in and out values indexed by block id.
+    """
+    if analysis.bits is not None:
+        return df_bitvector(graph, analysis, order, stats)
+
+    in_, out = solve(
+        graph, analysis.forward, analysis.init, analysis.merge,
+        lambda node, inval: analysis.transfer(graph.blocks[node], inval),
+        order, stats,
+    )
+    if analysis.forward:
+        return in_, out
+    else:
+        return out, in_
+
+
+def df_worklist(blocks, analysis, order='priority', stats=None):
+    """The worklist algorithm for iterating a data flow analysis to a
+    fixed point.
+
+    `blocks` may be a block map or a `cfg.CompactCFG`. Either way, produce
+    maps from block names to the in and out values. See `solve` for the
+    `order` and `stats` options.
+    """
+    if not isinstance(blocks, cfg.CompactCFG):
+        blocks = cfg.CompactCFG.from_block_map(blocks)
+    in_, out = df_worklist_compact(blocks, analysis, order, stats)
+    return dict(zip(blocks.labels, in_)), dict(zip(blocks.labels, out))
+
+
 def fmt(val):
     """Guess a good way to format a data flow value. (Works for sets and
     dicts, at least.)
@@ -79,13 +241,24 @@ def fmt(val):
         return str(val)
 
 
-def run_df(bril, analysis):
+def run_df(bril, analysis, analyses=None, order='priority', stats=None):
+    """Run a data flow analysis on every function and print the results.
+    Optionally, use the cached results in an `analyses.AnalysisManager`
+    (in which case the `order` and `stats` options to `solve` are
+    ignored).
+    """
     for func in bril['functions']:
-        # Form the CFG.
-        blocks = cfg.block_map(form_blocks(func['instrs']))
-        cfg.add_terminators(blocks)
+        if analyses is not None:
+            fa = analyses.get(func)
+            blocks = fa['blocks']
+            in_, out = fa.dataflow(analysis)
+        else:
+            # Form the CFG.
+            blocks = cfg.block_map(form_blocks(func['instrs']))
+            cfg.add_terminators(blocks)
 
-        in_, out = df_worklist(blocks, analysis)
+            in_, out = df_worklist(cfg.CompactCFG.from_block_map(blocks),
+                                   analysis, order, stats)
         for block in blocks:
             print('{}:'.format(block))
             print('  in: ', fmt(in_[block]))
@@ -144,6 +317,7 @@ ANALYSES = {
         init=set(),
         merge=union,
         transfer=lambda block, in_: in_.union(gen(block)),
+        bits=BitVector(gen=gen, kill=lambda block: (), meet='union'),
     ),
 
     # Live variable analysis: the variables that are both defined at a
@@ -153,6 +327,7 @@ ANALYSES = {
         init=set(),
         merge=union,
         transfer=lambda block, out: use(block).union(out - gen(block)),
+        bits=BitVector(gen=use, kill=gen, meet='union'),
     ),
 
     # A simple constant propagation pass.
@@ -165,5 +340,12 @@ ANALYSES = {
 }
 
 if __name__ == '__main__':
+    # Use `-f` for the plain FIFO worklist and `-s` to report the number of
+    # blocks the solver visited (on stderr).
     bril = json.load(sys.stdin)
-    run_df(bril, ANALYSES[sys.argv[1]])
+    stats = {'iterations': 0}
+    run_df(bril, ANALYSES[sys.argv[1]],
+           order='fifo' if '-f' in sys.argv[2:] else 'priority',
+           stats=stats)
+    if '-s' in sys.argv[2:]:
+        print('iterations: {}'.format(stats['iterations']), file=sys.stderr)
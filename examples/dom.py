@@ -1,7 +1,9 @@
 import json
 import sys
+from array import array
+from collections.abc import Mapping
 
-from cfg import block_map, successors, add_terminators, add_entry
+from cfg import block_map, add_terminators, add_entry, CompactCFG
 from form_blocks import form_blocks
 
 
@@ -47,33 +49,361 @@ def intersect(sets):
     return out
 
 
-def get_dom(succ, entry):
-    pred = map_inv(succ)
-    nodes = list(reversed(postorder(succ, entry)))  # Reverse postorder.
+def idom_chk(graph, entry=0):
+    """Compute immediate dominators over a `cfg.CompactCFG` with the
+    iterative algorithm of Cooper, Harvey, and Kennedy ("A Simple, Fast
+    Dominance Algorithm").
 
-    dom = {v: set(nodes) for v in succ}
-
-    while True:
+    Produce an array, indexed by block id, of immediate dominator ids. The
+    entry is its own immediate dominator, and unreachable blocks have -1.
+    """
+    n = len(graph)
+    po = graph.postorder(entry)
+    po_num = array('l', [-1]) * n
+    for i, node in enumerate(po):
+        po_num[node] = i
+
+    idom = array('l', [-1]) * n
+    idom[entry] = entry
+    rpo = po[-2::-1]  # Reverse postorder, without the entry.
+
+    changed = True
+    while changed:
         changed = False
+        for node in rpo:
+            # Intersect the dominators of all the processed predecessors
+            # by walking up the (partial) dominator tree.
+            new_idom = -1
+            for p in graph.preds(node):
+                if idom[p] == -1:
+                    continue
+                if new_idom == -1:
+                    new_idom = p
+                    continue
+                a, b = p, new_idom
+                while a != b:
+                    while po_num[a] < po_num[b]:
+                        a = idom[a]
+                    while po_num[b] < po_num[a]:
+                        b = idom[b]
+                new_idom = a
+
+            if idom[node] != new_idom:
+                idom[node] = new_idom
+                changed = True
 
-        for node in nodes:
-            new_dom = intersect(dom[p] for p in pred[node])
-            new_dom.add(node)
+    return idom
 
-            if dom[node] != new_dom:
-                dom[node] = new_dom
-                changed = True
 
-        if not changed:
-            break
+def idom_lt(graph, entry=0):
+    """Compute immediate dominators like `idom_chk`, but with the
+    Lengauer-Tarjan algorithm (the simple version, with path compression).
+    This takes near-linear time regardless of the graph's shape, so it can
+    beat `idom_chk` on very large graphs that need many iterations.
+    """
+    n = len(graph)
+
+    # Number the reachable blocks in depth-first preorder.
+    dfnum = array('l', [-1]) * n
+    parent = array('l', [-1]) * n
+    vertex = []
+    stack = [(entry, -1)]
+    while stack:
+        node, p = stack.pop()
+        if dfnum[node] != -1:
+            continue
+        dfnum[node] = len(vertex)
+        vertex.append(node)
+        parent[node] = p
+        for s in reversed(graph.succs(node)):
+            if dfnum[s] == -1:
+                stack.append((s, node))
+
+    semi = array('l', range(n))
+    ancestor = array('l', [-1]) * n
+    best = array('l', range(n))
+    samedom = array('l', [-1]) * n
+    idom = array('l', [-1]) * n
+    bucket = [[] for _ in range(n)]
+
+    def lowest_semi(v):
+        # The ancestor of `v` (in the forest linked so far) whose
+        # semidominator has the smallest number, compressing the path as
+        # we go.
+        path = []
+        while ancestor[ancestor[v]] != -1:
+            path.append(v)
+            v = ancestor[v]
+        b = best[v]
+        while path:
+            v = path.pop()
+            ancestor[v] = ancestor[ancestor[v]]
+            if dfnum[semi[b]] < dfnum[semi[best[v]]]:
+                best[v] = b
+            b = best[v]
+        return b
+
+    for w in reversed(vertex[1:]):
+        p = parent[w]
+
+        # Find the semidominator of `w`.
+        s = p
+        for v in graph.preds(w):
+            if dfnum[v] == -1:
+                continue  # Unreachable.
+            if dfnum[v] <= dfnum[w]:
+                s2 = v
+            else:
+                s2 = semi[lowest_semi(v)]
+            if dfnum[s2] < dfnum[s]:
+                s = s2
+        semi[w] = s
+        bucket[s].append(w)
+
+        # Link `w` into the forest and find the immediate dominators (or
+        # the blocks that share them) of the blocks whose semidominator
+        # is `p`.
+        ancestor[w] = p
+        for v in bucket[p]:
+            y = lowest_semi(v)
+            if semi[y] == semi[v]:
+                idom[v] = p
+            else:
+                samedom[v] = y
+        bucket[p] = []
+
+    for w in vertex[1:]:
+        if samedom[w] != -1:
+            idom[w] = idom[samedom[w]]
+    idom[entry] = entry
+    return idom
+
+
+IDOM_ALGORITHMS = {
+    'chk': idom_chk,
+    'lt': idom_lt,
+}
+
+
+class Dominators:
+    """Dominance information for a `cfg.CompactCFG`.
+
+    The only thing computed up front is `idom`, the array of immediate
+    dominators (see `idom_chk`). The dominator sets, the dominator tree,
+    and the dominance frontier are derived from it on demand, in the same
+    label-based form as `get_dom`, `dom_tree`, and `dom_fronts` have always
+    produced.
+
+    Those functions (based on dominator sets) give every unreachable
+    block all the reachable blocks as its dominators. The derived results
+    here reproduce the consequences of that exactly, so that passes like
+    `to_ssa` produce the same output with either representation.
+    """
+
+    def __init__(self, graph, entry=0, algorithm='chk'):
+        self.graph = graph
+        self.entry = entry
+        self.idom = IDOM_ALGORITHMS[algorithm](graph, entry)
+        self._children = None
+        self._numbering = None
+        self._frontiers = None
+
+    def reachable(self, i):
+        return self.idom[i] != -1
+
+    def children(self):
+        """A list, indexed by block id, of the children of each block in
+        the dominator tree (in id order).
+        """
+        if self._children is None:
+            children = [[] for _ in range(len(self.graph))]
+            for i, d in enumerate(self.idom):
+                if d != -1 and i != self.entry:
+                    children[d].append(i)
+            self._children = children
+        return self._children
+
+    def numbering(self):
+        """Number the dominator tree in preorder. Produce the list of
+        block ids in preorder and arrays mapping each id to its preorder
+        position and to the position of the last block in its subtree. So
+        the subtree of `i` is `order[pre[i]:last[i] + 1]`.
+        """
+        if self._numbering is None:
+            n = len(self.graph)
+            children = self.children()
+            order = []
+            pre = array('l', [-1]) * n
+            stack = [self.entry]
+            while stack:
+                node = stack.pop()
+                pre[node] = len(order)
+                order.append(node)
+                stack.extend(reversed(children[node]))
+
+            last = array('l', [-1]) * n
+            for node in reversed(order):
+                last[node] = max((last[c] for c in children[node]),
+                                 default=pre[node])
+            self._numbering = order, pre, last
+        return self._numbering
+
+    def dominates(self, a, b):
+        """Check whether block `a` dominates block `b` (both reachable).
+        """
+        _, pre, last = self.numbering()
+        return pre[a] <= pre[b] <= last[a]
+
+    def dom_sets(self, i):
+        """The set of block ids that dominate block `i`.
+        """
+        idom = self.idom
+        if idom[i] == -1:
+            _, pre, _ = self.numbering()
+            return {j for j in range(len(self.graph)) if pre[j] != -1}
+        out = {i}
+        while i != self.entry:
+            i = idom[i]
+            out.add(i)
+        return out
+
+    def sets(self):
+        """The dominators of every block, as a lazy mapping like the one
+        `get_dom` produces.
+        """
+        return DomSets(self)
+
+    def tree(self):
+        """The dominator tree, as a map from block names to the set of
+        their children's names (like `dom_tree`).
+        """
+        labels = self.graph.labels
+        children = self.children()
+
+        # Every unreachable block is dominated by all the reachable ones,
+        # so it is an immediate child of every leaf.
+        unreachable = {labels[i] for i, d in enumerate(self.idom) if d == -1}
+
+        out = {}
+        for i, name in enumerate(labels):
+            if self.idom[i] == -1:
+                out[name] = set()
+            elif children[i]:
+                out[name] = {labels[c] for c in children[i]}
+            else:
+                out[name] = set(unreachable)
+        return out
+
+    def frontiers(self, bits=False):
+        """The dominance frontier of every block: a list, indexed by block
+        id, of sets of block ids. With `bits`, produce each set as an
+        integer bitset (bit `i` is set for block `i`) instead.
+
+        This is the join-point algorithm from Cooper, Harvey, and Kennedy:
+        a block is in the frontier of each block on the dominator tree
+        path from each of its predecessors up to (but not including) its
+        immediate dominator.
+        """
+        if self._frontiers is None:
+            graph, idom = self.graph, self.idom
+            n = len(graph)
+            fronts = [set() for _ in range(n)]
+            orphans = set()
+            for b in range(n):
+                if idom[b] == -1:
+                    continue
+                for p in graph.preds(b):
+                    if idom[p] == -1:
+                        orphans.add(b)
+                        continue
+                    runner = p
+                    while runner != idom[b]:
+                        fronts[runner].add(b)
+                        runner = idom[runner]
+
+            # Every reachable block dominates the unreachable ones, so a
+            # block with an unreachable predecessor is in the frontier of
+            # every reachable block that does not strictly dominate it.
+            for b in orphans:
+                strict = self.dom_sets(b) - {b}
+                for a in range(n):
+                    if idom[a] != -1 and a not in strict:
+                        fronts[a].add(b)
+
+            self._frontiers = fronts
+
+        if bits:
+            return [sum(1 << b for b in f) for f in self._frontiers]
+        return self._frontiers
+
+    def iterated_frontier(self, blocks):
+        """The iterated dominance frontier of a set of block ids: the
+        blocks that need a phi-node for a variable defined in `blocks`.
+        """
+        fronts = self.frontiers()
+        out = set()
+        work = list(blocks)
+        seen = set(work)
+        while work:
+            for f in fronts[work.pop()]:
+                if f not in out:
+                    out.add(f)
+                    if f not in seen:
+                        seen.add(f)
+                        work.append(f)
+        return out
+
+    def fronts(self):
+        """The dominance frontier, as a map from block names to lists of
+        names (like `dom_fronts`).
+        """
+        labels = self.graph.labels
+        return {name: [labels[b] for b in f]
+                for name, f in zip(labels, self.frontiers())}
+
+
+class DomSets(Mapping):
+    """A map from block names to the sets of names of their dominators,
+    computed on demand from a `Dominators`.
+    """
+
+    def __init__(self, dominators):
+        self.dominators = dominators
+
+    def __getitem__(self, name):
+        graph = self.dominators.graph
+        return {graph.labels[d]
+                for d in self.dominators.dom_sets(graph.ids[name])}
 
-    return dom
+    def __iter__(self):
+        return iter(self.dominators.graph.labels)
+
+    def __len__(self):
+        return len(self.dominators.graph)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def get_dom(succ, entry, algorithm='chk'):
+    """Compute the dominators for every node in a CFG, given as either a
+    successor edge map or a `cfg.CompactCFG`. Either way, produce a
+    (lazy) map from block names to sets of block names.
+    """
+    if isinstance(succ, CompactCFG):
+        graph = succ
+    else:
+        graph = CompactCFG.from_succ(succ)
+    return Dominators(graph, graph.ids[entry], algorithm).sets()
 
 
 def dom_fronts(dom, succ):
     """Compute the dominance frontier, given the dominance relation.
     """
-    dom_inv = map_inv(dom)
+    if isinstance(dom, DomSets):
+        return dom.dominators.fronts()
+
+    dom_inv = {a: set(bs) for a, bs in map_inv(dom).items()}
 
     frontiers = {}
     for block in dom:
@@ -91,6 +421,9 @@ def dom_fronts(dom, succ):
 
 
 def dom_tree(dom):
+    if isinstance(dom, DomSets):
+        return dom.dominators.tree()
+
     # Get the blocks strictly dominated by a block strictly dominated by
     # a given block.
     dom_inv = map_inv(dom)
@@ -104,20 +437,29 @@ def dom_tree(dom):
     }
 
 
-def print_dom(bril, mode):
+def print_dom(bril, mode, analyses=None, algorithm='chk'):
+    """Print the dominators, dominance frontier, or dominator tree for
+    every function. Optionally, use the cached results in an
+    `analyses.AnalysisManager`.
+    """
     for func in bril['functions']:
-        blocks = block_map(form_blocks(func['instrs']))
-        add_entry(blocks)
-        add_terminators(blocks)
-        succ = {name: successors(block[-1]) for name, block in blocks.items()}
-        dom = get_dom(succ, list(blocks.keys())[0])
-
-        if mode == 'front':
-            res = dom_fronts(dom, succ)
-        elif mode == 'tree':
-            res = dom_tree(dom)
+        if analyses is not None:
+            fa = analyses.get(func)
+            res = fa[{'front': 'dom_fronts', 'tree': 'dom_tree'}
+                     .get(mode, 'dom')]
         else:
-            res = dom
+            blocks = block_map(form_blocks(func['instrs']))
+            add_entry(blocks)
+            add_terminators(blocks)
+            dominators = Dominators(CompactCFG.from_block_map(blocks),
+                                    algorithm=algorithm)
+
+            if mode == 'front':
+                res = dominators.fronts()
+            elif mode == 'tree':
+                res = dominators.tree()
+            else:
+                res = dominators.sets()
 
         # Format as JSON for stable output.
         print(json.dumps(
@@ -127,7 +469,10 @@ def print_dom(bril, mode):
 
 
 if __name__ == '__main__':
+    # Use `-l` to compute dominators with Lengauer-Tarjan.
+    args = [a for a in sys.argv[1:] if a != '-l']
     print_dom(
         json.load(sys.stdin),
-        'dom' if len(sys.argv) < 2 else sys.argv[1]
+        args[0] if args else 'dom',
+        algorithm='lt' if '-l' in sys.argv[1:] else 'chk',
     )
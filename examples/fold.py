@@ -0,0 +1,36 @@
+"""Constant folding for Bril's core value operations.
+
+The optimizations that fold constants (`lvn.py`, `gvn.py`, and
+`sccp.py`) share this table so they all agree with the interpreter:
+integers are 64-bit two's complement, and division truncates toward zero.
+"""
+
+
+def wrap(n):
+    """Wrap an integer to 64-bit two's complement."""
+    return (n + 2 ** 63) % 2 ** 64 - 2 ** 63
+
+
+def div(a, b):
+    """Bril division, which truncates toward zero. Raises a
+    ZeroDivisionError if `b` is zero.
+    """
+    q = abs(a) // abs(b)
+    return wrap(q if (a < 0) == (b < 0) else -q)
+
+
+FOLDABLE_OPS = {
+    'add': lambda a, b: wrap(a + b),
+    'mul': lambda a, b: wrap(a * b),
+    'sub': lambda a, b: wrap(a - b),
+    'div': div,
+    'gt': lambda a, b: a > b,
+    'lt': lambda a, b: a < b,
+    'ge': lambda a, b: a >= b,
+    'le': lambda a, b: a <= b,
+    'ne': lambda a, b: a != b,
+    'eq': lambda a, b: a == b,
+    'or': lambda a, b: a or b,
+    'and': lambda a, b: a and b,
+    'not': lambda a: not a
+}
@@ -53,18 +53,23 @@ def print_blocks(bril):
     import briltxt
 
     func = bril['functions'][0]  # We only process one function.
+    out = []
     for block in form_blocks(func['instrs']):
         # Mark the block.
         leader = block[0]
         if 'label' in leader:
-            print('block "{}":'.format(leader['label']))
+            out.append('block "{}":'.format(leader['label']))
             block = block[1:]  # Hide the label, for concision.
         else:
-            print('anonymous block:')
+            out.append('anonymous block:')
 
-        # Print the instructions.
-        for instr in block:
-            print('  {}'.format(briltxt.instr_to_string(instr)))
+        # Format the instructions.
+        if block:
+            out.append(briltxt.instrs_to_string(block, end=''))
+
+    # Print everything at once.
+    if out:
+        print('\n'.join(out))
 
 
 if __name__ == '__main__':
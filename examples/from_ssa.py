@@ -1,14 +1,25 @@
 import json
 import sys
+from collections import Counter
 
-from cfg import block_map, add_terminators, add_entry, reassemble
+from cfg import (block_map, add_terminators, add_entry, reassemble, edges,
+                 drop_fallthroughs, CompactCFG)
 from form_blocks import form_blocks
+from util import fresh
+import df
 
+# The placeholder `to_ssa` uses for a phi argument that is undefined along
+# an edge. It needs no copy.
+UNDEFINED = '__undefined'
 
-def func_from_ssa(func):
-    blocks = block_map(form_blocks(func['instrs']))
-    add_entry(blocks)
-    add_terminators(blocks)
+
+def func_from_ssa(func, analyses=None):
+    if analyses is None:
+        blocks = block_map(form_blocks(func['instrs']))
+        add_entry(blocks)
+        add_terminators(blocks)
+    else:
+        blocks = analyses['cfg']
 
     # Replace each phi-node.
     for block in blocks.values():
@@ -37,11 +48,288 @@ def func_from_ssa(func):
     func['instrs'] = reassemble(blocks)
 
 
-def from_ssa(bril):
+def ssa_liveness(blocks, graph=None):
+    """Compute live variables in a function that contains phi-nodes.
+
+    A phi-node's destination is defined at the top of its block, and each
+    of its arguments is used at the end of the corresponding predecessor
+    (not in the phi-node's block). Produce maps from block names to the
+    variables live at the start of each block (after its phi-nodes) and at
+    the end of each block (after its terminator). `graph` is the blocks'
+    `cfg.CompactCFG`, if we already have it.
+    """
+    if graph is None:
+        graph = CompactCFG.from_block_map(blocks)
+    uses = []
+    defs = []
+    phi_uses = {name: set() for name in blocks}
+    for name, block in blocks.items():
+        used = set()
+        defined = set()
+        for instr in block:
+            if instr.get('op') == 'phi':
+                defined.add(instr['dest'])
+                for label, arg in zip(instr['labels'], instr['args']):
+                    if arg != UNDEFINED:
+                        phi_uses[label].add(arg)
+                continue
+            used.update(a for a in instr.get('args', ())
+                        if a not in defined)
+            if 'dest' in instr:
+                defined.add(instr['dest'])
+        uses.append(used)
+        defs.append(defined)
+    phi_out = [phi_uses[name] for name in graph.labels]
+
+    out, in_ = df.solve(
+        graph, False, set(), df.union,
+        lambda node, out: uses[node] | ((out | phi_out[node]) - defs[node]),
+    )
+
+    # The phi-node destinations are not live on entry to the block, but
+    # they are live after the phi-nodes if anything later uses them.
+    live_in = {}
+    live_out = {}
+    for i, name in enumerate(graph.labels):
+        live_out[name] = out[i] | phi_out[i]
+        live_in[name] = in_[i]
+    return live_in, live_out
+
+
+def phi_interference(blocks, args, live=None):
+    """Find which of the variables related by phi-nodes (or that are
+    function arguments) interfere: that is, one is live where the other is
+    defined. Produce a map from each such variable to the set of related
+    variables it interferes with. `live` is the `ssa_liveness` of the
+    blocks, if we already have it.
+    """
+    related = set(args)
+    for block in blocks.values():
+        for instr in block:
+            if instr.get('op') == 'phi':
+                related.add(instr['dest'])
+                related.update(a for a in instr['args'] if a != UNDEFINED)
+
+    interf = {v: set() for v in related}
+
+    def _add(group, live):
+        # The variables in `group` are defined at the same point, where the
+        # ones in `live` are live afterward.
+        group = [v for v in group if v in related]
+        others = (live & related).union(group)
+        for v in group:
+            for w in others:
+                if v != w:
+                    interf[v].add(w)
+                    interf[w].add(v)
+
+    if live is None:
+        live = ssa_liveness(blocks)
+    live_in, live_out = live
+    for i, (name, block) in enumerate(blocks.items()):
+        live = set(live_out[name])
+        for instr in reversed(block):
+            if instr.get('op') == 'phi':
+                continue
+            if 'dest' in instr:
+                _add([instr['dest']], live)
+                live.discard(instr['dest'])
+            live.update(instr.get('args', ()))
+
+        # All the phi-nodes in a block (and the function arguments, in
+        # the entry block) are defined simultaneously.
+        group = [instr['dest'] for instr in block
+                 if instr.get('op') == 'phi']
+        if i == 0:
+            group += args
+        _add(group, live)
+
+    return interf
+
+
+def coalesce(blocks, args, live=None):
+    """Choose names for the variables related by phi-nodes so that as
+    many phi-node arguments as possible get the same name as the phi-node's
+    destination, without merging any interfering variables. Function
+    arguments keep their names. Produce a map from each variable that
+    gets renamed to its new name. `live` is as in `phi_interference`.
+    """
+    interf = phi_interference(blocks, args, live)
+    parent = {}
+
+    def find(v):
+        while parent.get(v, v) != v:
+            parent[v] = parent.get(parent[v], parent[v])
+            v = parent[v]
+        return v
+
+    # The interference and argument status of each class, by its root.
+    class_interf = {v: set(ws) for v, ws in interf.items()}
+    is_arg = {v: True for v in args}
+
+    for block in blocks.values():
+        for instr in block:
+            if instr.get('op') != 'phi':
+                continue
+            for arg in instr['args']:
+                if arg == UNDEFINED:
+                    continue
+                a, b = find(instr['dest']), find(arg)
+                if a == b:
+                    continue
+                if is_arg.get(a) and is_arg.get(b):
+                    continue
+                if any(find(w) == b for w in class_interf[a]):
+                    continue
+
+                # Merge the classes, keeping an argument's name.
+                if is_arg.get(b):
+                    a, b = b, a
+                parent[b] = a
+                class_interf[a] |= class_interf.pop(b)
+                is_arg[a] = is_arg.get(a) or is_arg.pop(b, False)
+
+    return {v: find(v) for v in interf if find(v) != v}
+
+
+def sequentialize(copies, names):
+    """Order a parallel copy so it can run as a sequence of copies.
+
+    `copies` is a list of `(dest, src, type)` tuples with distinct
+    destinations, all of which read their sources before any of them
+    writes. Produce an equivalent list of copies to run in order, using
+    a fresh temporary (added to `names`) to break each cycle.
+    """
+    pending = {d: (s, t) for d, s, t in copies if d != s}
+    readers = Counter(s for s, _ in pending.values())
+    ready = [d for d in pending if not readers[d]]
+    out = []
+    while pending:
+        # Emit every copy whose destination no other copy still reads.
+        while ready:
+            d = ready.pop()
+            s, t = pending.pop(d)
+            out.append((d, s, t))
+            readers[s] -= 1
+            if not readers[s] and s in pending:
+                ready.append(s)
+
+        if pending:
+            # What's left are cycles. Break one by saving a destination's
+            # old value in a temporary.
+            d = min(pending)
+            t = pending[d][1]
+            tmp = fresh(d + '.tmp', names)
+            names.add(tmp)
+            out.append((tmp, d, t))
+            for x, (s, st) in pending.items():
+                if s == d:
+                    pending[x] = (tmp, st)
+            readers[tmp] = readers.pop(d)
+            ready.append(d)
+
+    return out
+
+
+def func_from_ssa_coalesce(func, analyses=None):
+    """Convert a function out of SSA form in place, like `func_from_ssa`,
+    but with fewer and correctly ordered copies.
+
+    Phi-related variables that do not interfere are renamed to the same
+    variable, so their copies disappear. The phi-nodes along each edge
+    become a parallel copy, which is sequentialized (see `sequentialize`)
+    and placed at the end of the predecessor, at the start of the
+    successor, or, for critical edges, in a new block on the edge.
+    """
+    # No need for `add_entry`: it would only add a block for the phi-nodes
+    # that mention the first block, which go away.
+    if analyses is None:
+        blocks = block_map(form_blocks(func['instrs']))
+        add_terminators(blocks)
+        live = None
+    else:
+        blocks = analyses['blocks']
+        live = analyses['ssa_live']
+    args = [a['name'] for a in func.get('args', [])]
+
+    # Rename coalesced variables everywhere.
+    names = coalesce(blocks, args, live)
+
+    def _name(v):
+        return names.get(v, v)
+
+    for block in blocks.values():
+        for instr in block:
+            if 'dest' in instr:
+                instr['dest'] = _name(instr['dest'])
+            if 'args' in instr:
+                instr['args'] = [_name(a) for a in instr['args']]
+
+    # Gather the copies on each edge and remove the phi-nodes.
+    all_names = set(args)
+    edge_copies = {}
+    for name, block in blocks.items():
+        for instr in block:
+            if 'dest' in instr:
+                all_names.add(instr['dest'])
+            if instr.get('op') == 'phi':
+                for label, arg in zip(instr['labels'], instr['args']):
+                    if arg != UNDEFINED and arg != instr['dest']:
+                        edge_copies.setdefault((label, name), []).append(
+                            (instr['dest'], arg, instr['type']))
+        block[:] = [i for i in block if i.get('op') != 'phi']
+
+    # The copies can go at the end of a predecessor that only jumps to the
+    # block (a branch might read a variable they write), or at the start
+    # of a block with no other way in (including from the function entry).
+    preds, _ = edges(blocks)
+    entry = next(iter(blocks))
+    for (pred, succ), copies in edge_copies.items():
+        copies = [
+            {'op': 'id', 'dest': d, 'type': t, 'args': [s]}
+            for d, s, t in sequentialize(copies, all_names)
+        ]
+        pred_block = blocks[pred]
+        if pred_block[-1]['op'] == 'jmp':
+            pred_block[-1:-1] = copies
+        elif len(set(preds[succ])) == 1 and succ != entry:
+            blocks[succ][0:0] = copies
+        else:
+            # Split the critical edge.
+            label = fresh('{}.{}.'.format(pred, succ), blocks)
+            blocks[label] = copies + [{'op': 'jmp', 'labels': [succ]}]
+            term = pred_block[-1]
+            term['labels'] = [label if lbl == succ else lbl
+                              for lbl in term['labels']]
+
+    drop_fallthroughs(blocks)
+    func['instrs'] = reassemble(blocks)
+
+
+# Ways to translate out of SSA form:
+# - naive: One copy per phi-node argument, at the end of the predecessor.
+# - coalesce: See `func_from_ssa_coalesce`.
+MODES = {
+    'naive': func_from_ssa,
+    'coalesce': func_from_ssa_coalesce,
+}
+
+
+def from_ssa(bril, mode='naive', analyses=None):
+    """Convert every function in a program out of SSA form. Optionally,
+    take the CFG and liveness from the cached results in an
+    `analyses.AnalysisManager`. The cached blocks are modified in place,
+    so the caller must invalidate the analyses afterward.
+    """
     for func in bril['functions']:
-        func_from_ssa(func)
+        fa = analyses.get(func) if analyses is not None else None
+        MODES[mode](func, fa)
     return bril
 
 
 if __name__ == '__main__':
-    print(json.dumps(from_ssa(json.load(sys.stdin)), indent=2, sort_keys=True))
+    print(json.dumps(
+        from_ssa(json.load(sys.stdin),
+                 sys.argv[1] if len(sys.argv) > 1 else 'naive'),
+        indent=2, sort_keys=True,
+    ))
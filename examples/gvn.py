@@ -0,0 +1,217 @@
+"""Global value numbering for Bril programs in SSA form.
+
+This extends local value numbering (see `lvn.py`) from basic blocks to
+whole functions. A value computed in one block is available in every
+block it dominates, so we walk the dominator tree and keep the table of
+available values scoped to it, as in the "dominator-based value
+numbering technique" of Briggs, Cooper, and Simpson ("Value Numbering",
+1997). Because every variable has a single definition, a redundant
+instruction can simply be deleted and its uses renamed.
+
+Run it on the output of `to_ssa.py`:
+
+    bril2json < prog.bril | python3 to_ssa.py | python3 gvn.py
+"""
+import json
+import sys
+from collections import OrderedDict
+
+from cfg import (block_map, add_terminators, drop_fallthroughs, reassemble,
+                 successors, CompactCFG)
+from dom import Dominators
+from form_blocks import form_blocks
+from from_ssa import UNDEFINED
+from is_ssa import is_ssa_func
+from lvn import Value, Numbering, _canonicalize, _fold
+
+# Value operations whose results do not depend only on their arguments
+# (or, for phi-nodes, that we handle separately).
+IMPURE_OPS = {'call', 'alloc', 'load', 'phi'}
+
+
+def gvn_func(func, analyses=None):
+    """Apply global value numbering to a function in place.
+
+    Delete instructions that recompute a value available from a
+    dominating block, fold constants, propagate copies, and remove
+    phi-nodes whose arguments all have the same value (or that duplicate
+    another phi-node in the same block). Functions that are not in SSA
+    form are left alone.
+
+    If `analyses` (an `analyses.FunctionAnalyses`) is given, take the
+    blocks and dominators from it. We never touch labels or terminators,
+    and the cached blocks are updated to match the new instructions, so
+    the `analyses.BLOCK_ANALYSES` remain valid afterward.
+    """
+    if not is_ssa_func(func):
+        return
+
+    # The idom-based dominators don't need `add_entry`: the first block is
+    # the entry even if it has predecessors.
+    if analyses is None:
+        blocks = block_map(form_blocks(func['instrs']))
+        add_terminators(blocks)
+        graph = CompactCFG.from_block_map(blocks)
+        children = Dominators(graph).children()
+    else:
+        blocks = analyses['blocks']
+        graph = analyses['blocks_compact']
+        children = analyses['blocks_idom'].children()
+
+    # Visit each block's children in reverse postorder, so the block's
+    # predecessors (along forward edges) are numbered before it. This
+    # lets us fold more phi-nodes.
+    rpo = {b: i for i, b in enumerate(reversed(graph.postorder()))}
+
+    # The value number of every variable. These are global, since every
+    # variable has one definition, which dominates all its uses.
+    var2num = Numbering()
+
+    # The variable that holds each value number. When an instruction is
+    # redundant, its destination gets the existing number and all its
+    # uses are renamed to this variable.
+    num2var = {}
+
+    # Track constant values for `const` instructions and folded ones.
+    num2const = {}
+
+    # The available values. Entries are added while visiting a block and
+    # removed after visiting its dominator subtree.
+    value2num = {}
+
+    def _number(var):
+        # Reading a variable we have not seen (e.g., an argument) gives it
+        # a fresh number.
+        if var not in var2num:
+            num2var[var2num.add(var)] = var
+        return var2num[var]
+
+    def _phi(block, instr):
+        # Find an existing number for a phi-node's value and a key for it
+        # in `value2num` (either of which may be None). Ignore undefined
+        # arguments and the phi-node itself.
+        args = sorted(zip(instr['labels'], instr['args']))
+        nums = {var2num.get(arg) for _, arg in args
+                if arg not in (UNDEFINED, instr['dest'])}
+        if len(nums) == 1 and None not in nums:
+            return nums.pop(), None
+
+        key = Value('phi', (block,) + tuple(
+            (label, arg if arg == UNDEFINED else var2num.get(arg))
+            for label, arg in args
+        ))
+        if any(n is None for _, n in key.args[1:]):
+            return None, None
+        return value2num.get(key), key
+
+    def _visit(name):
+        # Number a block's instructions, dropping the redundant ones, and
+        # return the keys it added to `value2num`.
+        added = []
+        new_block = []
+        for instr in blocks[name]:
+            if instr.get('op') == 'phi':
+                num, key = _phi(name, instr)
+                if num is not None:
+                    var2num[instr['dest']] = num
+                    continue
+                num = var2num.add(instr['dest'])
+                num2var[num] = instr['dest']
+                if key is not None:
+                    value2num[key] = num
+                    added.append(key)
+                new_block.append(instr)
+                continue
+
+            # Rename arguments to the canonical variables.
+            argnums = tuple(_number(a) for a in instr.get('args', ()))
+            if 'args' in instr:
+                instr['args'] = [num2var[n] for n in argnums]
+
+            if 'dest' not in instr:
+                new_block.append(instr)
+                continue
+            dest = instr['dest']
+
+            # Construct a Value for this computation. Propagate copies
+            # and fold constants.
+            num = None
+            if instr['op'] in IMPURE_OPS:
+                val = None
+            elif instr['op'] == 'id':
+                val = None
+                num = argnums[0]
+            elif instr['op'] == 'const':
+                val = Value('const', (instr['type'], instr['value']))
+            else:
+                val = _canonicalize(Value(instr['op'], argnums))
+                const = _fold(num2const, val)
+                if const is not None:
+                    instr.update({'op': 'const', 'value': const})
+                    del instr['args']
+                    val = Value('const', (instr['type'], const))
+
+            # Is this value already available?
+            if val is not None:
+                num = value2num.get(val)
+            if num is not None:
+                var2num[dest] = num
+                continue
+
+            num = var2num.add(dest)
+            num2var[num] = dest
+            if instr['op'] == 'const':
+                num2const[num] = instr['value']
+            if val is not None:
+                value2num[val] = num
+                added.append(val)
+            new_block.append(instr)
+
+        blocks[name][:] = new_block
+
+        # Rename the phi-node arguments for this block in its successors.
+        for succ in successors(new_block[-1]):
+            for instr in blocks[succ]:
+                if instr.get('op') == 'phi':
+                    instr['args'] = [
+                        num2var[var2num[arg]]
+                        if label == name and arg in var2num else arg
+                        for label, arg in zip(instr['labels'], instr['args'])
+                    ]
+
+        return added
+
+    # Walk the dominator tree in preorder with an explicit stack. After a
+    # block's children, the stack holds the keys it added, which we remove
+    # again when we leave its subtree.
+    work = [0]
+    while work:
+        item = work.pop()
+        if isinstance(item, list):
+            for key in item:
+                del value2num[key]
+            continue
+
+        work.append(_visit(graph.labels[item]))
+        work.extend(sorted(children[item], key=rpo.__getitem__,
+                           reverse=True))
+
+    # Drop the fall-through terminators from copies of the blocks, so the
+    # blocks (and the graph built from them) still have theirs.
+    blocks = OrderedDict((name, list(block)) for name, block in blocks.items())
+    drop_fallthroughs(blocks)
+    func['instrs'] = reassemble(blocks)
+
+
+def gvn(bril, analyses=None):
+    """Apply global value numbering to every function in a program.
+    Optionally, use and update the cached results in an
+    `analyses.AnalysisManager`.
+    """
+    for func in bril['functions']:
+        gvn_func(func, analyses.get(func) if analyses is not None else None)
+    return bril
+
+
+if __name__ == '__main__':
+    print(json.dumps(gvn(json.load(sys.stdin)), indent=2, sort_keys=True))
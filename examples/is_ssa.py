@@ -2,20 +2,26 @@ import json
 import sys
 
 
+def is_ssa_func(func):
+    """Check whether a single function is in SSA form: it assigns to
+    each variable once.
+    """
+    assigned = set()
+    for instr in func['instrs']:
+        if 'dest' in instr:
+            if instr['dest'] in assigned:
+                return False
+            else:
+                assigned.add(instr['dest'])
+    return True
+
+
 def is_ssa(bril):
     """Check whether a Bril program is in SSA form.
 
     Every function in the program may assign to each variable once.
     """
-    for func in bril['functions']:
-        assigned = set()
-        for instr in func['instrs']:
-            if 'dest' in instr:
-                if instr['dest'] in assigned:
-                    return False
-                else:
-                    assigned.add(instr['dest'])
-    return True
+    return all(is_ssa_func(func) for func in bril['functions'])
 
 
 if __name__ == '__main__':
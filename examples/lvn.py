@@ -1,9 +1,12 @@
 """Local value numbering for Bril.
 """
+import functools
 import json
 import sys
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 
+import parallel
+from fold import FOLDABLE_OPS
 from form_blocks import form_blocks
 from util import flatten
 
@@ -91,13 +94,19 @@ def lvn_block(block, lookup, canonicalize, fold):
     # The *canonical* variable name holding a given numbered value.
     # There is only one canonical variable per value number (so this is
     # not the inverse of var2num). To make matters even more
-    # complicated, we will also keep a *list* of possible names here,
+    # complicated, we will also keep an ordered *set* of possible names
+    # here (a dict with None values, which remembers insertion order),
     # where the first is the canonical one to use. This is only relevant
     # when doing copy-propagation, and it helps with situations where a
     # copy-propagated variable is later "clobbered" so we can fall back
     # to a different variable holding the same value.
     num2vars = {}
 
+    # The inverse of `num2vars`: the value numbers whose sets contain a
+    # given variable. This lets us find the sets to update when the
+    # variable is clobbered without scanning all of them.
+    var2homes = defaultdict(set)
+
     # Track constant values for values assigned with `const`.
     num2const = {}
 
@@ -105,7 +114,8 @@ def lvn_block(block, lookup, canonicalize, fold):
     # variables are their own canonical source.
     for var in read_first(block):
         num = var2num.add(var)
-        num2vars[num] = [var]
+        num2vars[num] = {var: None}
+        var2homes[var].add(num)
 
     for instr, last_write in zip(block, last_writes(block)):
         # Look up the value numbers for all variable arguments,
@@ -115,15 +125,14 @@ def lvn_block(block, lookup, canonicalize, fold):
 
         # Update argument variable names to canonical variables.
         if 'args' in instr:
-            instr['args'] = [num2vars[n][0] for n in argnums]
+            instr['args'] = [next(iter(num2vars[n])) for n in argnums]
 
         # If we write to a variable, we "clobber" any previous value it
         # may have held. Remove any entries that point to this variable
         # as the "home" for old values.
         if 'dest' in instr:
-            for rhs in num2vars.values():
-                if instr['dest'] in rhs:
-                    rhs.remove(instr['dest'])
+            for num in var2homes.pop(instr['dest'], ()):
+                del num2vars[num][instr['dest']]
 
         # Non-call value operations are candidates for replacement. (We
         # could conceivably include calls to pure functions as values,
@@ -150,9 +159,10 @@ def lvn_block(block, lookup, canonicalize, fold):
                 else:  # Value is in a variable.
                     instr.update({
                         'op': 'id',
-                        'args': [num2vars[num][0]],
+                        'args': [next(iter(num2vars[num]))],
                     })
-                    num2vars[num].append(instr['dest'])
+                    num2vars[num][instr['dest']] = None
+                    var2homes[instr['dest']].add(num)
                 continue
 
         # If this instruction produces a result, give it a number.
@@ -173,7 +183,8 @@ def lvn_block(block, lookup, canonicalize, fold):
                 var = 'lvn.{}'.format(newnum)
 
             # Record the variable name and update the instruction.
-            num2vars[newnum] = [var]
+            num2vars[newnum] = {var: None}
+            var2homes[var].add(newnum)
             instr['dest'] = var
 
             if val is not None:
@@ -202,23 +213,6 @@ def _lookup(value2num, value):
         return value2num.get(value)
 
 
-FOLDABLE_OPS = {
-    'add': lambda a, b: a + b,
-    'mul': lambda a, b: a * b,
-    'sub': lambda a, b: a - b,
-    'div': lambda a, b: a // b,
-    'gt': lambda a, b: a > b,
-    'lt': lambda a, b: a < b,
-    'ge': lambda a, b: a >= b,
-    'le': lambda a, b: a <= b,
-    'ne': lambda a, b: a != b,
-    'eq': lambda a, b: a == b,
-    'or': lambda a, b: a or b,
-    'and': lambda a, b: a and b,
-    'not': lambda a: not a
-}
-
-
 def _fold(num2const, value):
     if value.op in FOLDABLE_OPS:
         try:
@@ -260,23 +254,35 @@ def _canonicalize(value):
         return value
 
 
-def lvn(bril, prop=False, canon=False, fold=False):
+def lvn_func(func, prop=False, canon=False, fold=False):
+    """Apply the local value numbering optimization to every basic block
+    in a function.
+    """
+    blocks = list(form_blocks(func['instrs']))
+    for block in blocks:
+        lvn_block(
+            block,
+            lookup=_lookup if prop else lambda v2n, v: v2n.get(v),
+            canonicalize=_canonicalize if canon else lambda v: v,
+            fold=_fold if fold else lambda n2c, v: None,
+        )
+    func['instrs'] = flatten(blocks)
+
+
+def lvn(bril, prop=False, canon=False, fold=False, jobs=None):
     """Apply the local value numbering optimization to every basic block
-    in every function.
+    in every function, optionally in `jobs` parallel processes (see
+    `parallel.map_functions`).
     """
-    for func in bril['functions']:
-        blocks = list(form_blocks(func['instrs']))
-        for block in blocks:
-            lvn_block(
-                block,
-                lookup=_lookup if prop else lambda v2n, v: v2n.get(v),
-                canonicalize=_canonicalize if canon else lambda v: v,
-                fold=_fold if fold else lambda n2c, v: None,
-            )
-        func['instrs'] = flatten(blocks)
+    parallel.map_functions(
+        functools.partial(lvn_func, prop=prop, canon=canon, fold=fold),
+        bril, jobs,
+    )
 
 
 if __name__ == '__main__':
+    # Use `--jobs N` to optimize functions in N processes.
+    jobs = parallel.pop_jobs(sys.argv)
     bril = json.load(sys.stdin)
-    lvn(bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv)
+    lvn(bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv, jobs)
     json.dump(bril, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,208 @@
+"""Run a sequence of passes over a Bril program in a single process.
+
+Each command-line argument names a pass followed by the options it would
+take as a standalone script, so this shell pipeline:
+
+    bril2json < prog.bril | python3 lvn.py -p -c -f | python3 tdce.py tdce+
+
+is equivalent to:
+
+    bril2json < prog.bril | python3 opt.py "lvn -p -c -f" "tdce tdce+"
+
+The program is only parsed and serialized once. Analysis passes (like
+`df` and `dom`) print their results instead of the program, so they must
+come last. Use `-t` to report the time each pass takes, the number of
+instructions it leaves behind, and the number of analyses it had to
+compute (on stderr).
+
+Passes share an `analyses.AnalysisManager`, so a CFG or dominator tree
+computed for one pass is reused by later ones until a transformation
+invalidates it.
+"""
+import json
+import sys
+import time
+from collections import namedtuple
+
+import lvn
+import gvn
+import sccp
+import tdce
+import to_ssa
+import from_ssa
+import df
+import dom
+import is_ssa
+from analyses import AnalysisManager, BLOCK_ANALYSES
+
+# A pass consists of these parts:
+# - run: A function that takes the program, a list of option strings, and
+#   an `AnalysisManager`. Transformations modify the program in place and
+#   return the names of the functions they changed (or None if any
+#   function may have changed).
+# - analysis: True if the pass prints results instead of transforming the
+#   program.
+# - preserves: The analyses that remain valid in changed functions.
+Pass = namedtuple('Pass', ['run', 'analysis', 'preserves'])
+
+
+def _lvn(bril, args, analyses):
+    lvn.lvn(bril, '-p' in args, '-c' in args, '-f' in args)
+
+
+def _gvn(bril, args, analyses):
+    gvn.gvn(bril, analyses)
+
+
+def _sccp(bril, args, analyses):
+    sccp.sccp(bril, analyses)
+
+
+def _tdce(bril, args, analyses):
+    # DCE only ever deletes instructions, so we can tell which functions
+    # it changed by their length.
+    modify_func = tdce.MODES[args[0]] if args else tdce.trivial_dce
+    changed = set()
+    for func in bril['functions']:
+        size = len(func['instrs'])
+        if modify_func is tdce.global_dce:
+            modify_func(func, analyses.get(func))
+        else:
+            modify_func(func)
+        if len(func['instrs']) != size:
+            changed.add(func['name'])
+    return changed
+
+
+def _to_ssa(bril, args, analyses):
+    to_ssa.to_ssa(bril, analyses, args[0] if args else None)
+
+
+def _from_ssa(bril, args, analyses):
+    from_ssa.from_ssa(bril, args[0] if args else 'naive', analyses)
+
+
+def _is_ssa(bril, args, analyses):
+    print('yes' if is_ssa.is_ssa(bril) else 'no')
+
+
+PASSES = {
+    # GVN keeps its cached blocks up to date (see `gvn.gvn_func`), and
+    # `to_ssa` turns the blocks of `cfg` into the new `blocks`. The other
+    # transformations invalidate everything: LVN edits the instructions
+    # without going through the cached blocks, DCE can delete an entire
+    # unlabeled block, SCCP deletes unreachable blocks and edges, and the
+    # naive `from_ssa` can add an entry block.
+    'lvn': Pass(_lvn, analysis=False, preserves=()),
+    'gvn': Pass(_gvn, analysis=False, preserves=BLOCK_ANALYSES),
+    'sccp': Pass(_sccp, analysis=False, preserves=()),
+    'tdce': Pass(_tdce, analysis=False, preserves=()),
+    'to_ssa': Pass(_to_ssa, analysis=False, preserves=BLOCK_ANALYSES),
+    'from_ssa': Pass(_from_ssa, analysis=False, preserves=()),
+    'df': Pass(
+        lambda bril, args, analyses: df.run_df(bril, df.ANALYSES[args[0]],
+                                               analyses),
+        analysis=True,
+        preserves=None,
+    ),
+    'dom': Pass(
+        lambda bril, args, analyses: dom.print_dom(
+            bril, args[0] if args else 'dom', analyses,
+        ),
+        analysis=True,
+        preserves=None,
+    ),
+    'is_ssa': Pass(_is_ssa, analysis=True, preserves=None),
+}
+
+
+def count_instrs(bril):
+    """Count the instructions (not labels) in a program.
+    """
+    return sum(1 for func in bril['functions']
+               for instr in func['instrs'] if 'op' in instr)
+
+
+def parse_pipeline(specs):
+    """Turn pass specifications like `"tdce tdce+"` into a list of
+    `(name, args)` pairs. Raise a ValueError for unknown passes or
+    misplaced analyses.
+    """
+    pipeline = []
+    for spec in specs:
+        name, *args = spec.split()
+        if name not in PASSES:
+            raise ValueError('unknown pass {}'.format(name))
+        pipeline.append((name, args))
+
+    for name, _ in pipeline[:-1]:
+        if PASSES[name].analysis:
+            raise ValueError('analysis {} must be the last pass'.format(name))
+    return pipeline
+
+
+def run_passes(bril, pipeline, report=None, analyses=None):
+    """Run a pipeline of passes over a program in place.
+
+    If `report` is a list, append a `(pass, seconds, instruction count,
+    analyses computed)` tuple to it for each pass.
+    """
+    if analyses is None:
+        analyses = AnalysisManager()
+
+    for name, args in pipeline:
+        p = PASSES[name]
+        computed = analyses.computed
+        start = time.perf_counter()
+        changed = p.run(bril, args, analyses)
+        elapsed = time.perf_counter() - start
+
+        # Invalidate analyses for the functions the pass changed.
+        if not p.analysis:
+            for func in bril['functions']:
+                if changed is None or func['name'] in changed:
+                    analyses.invalidate(func, p.preserves)
+
+        if report is not None:
+            report.append((' '.join([name] + args), elapsed,
+                           count_instrs(bril), analyses.computed - computed))
+
+
+def print_report(report, file=sys.stderr):
+    print('{:<24} {:>10} {:>8} {:>8}'.format('pass', 'time (ms)', 'instrs',
+                                             'analyses'), file=file)
+    for name, elapsed, count, computed in report:
+        print('{:<24} {:>10.2f} {:>8} {:>8}'.format(name, elapsed * 1000,
+                                                    count, computed),
+              file=file)
+    total = sum(r[1] for r in report)
+    print('{:<24} {:>10.2f}'.format('total', total * 1000), file=file)
+
+
+def opt(specs, timing=False):
+    pipeline = parse_pipeline(specs)
+    report = [] if timing else None
+
+    text = sys.stdin.read()
+    start = time.perf_counter()
+    bril = json.loads(text)
+    if timing:
+        report.append(('(load)', time.perf_counter() - start,
+                       count_instrs(bril), 0))
+
+    run_passes(bril, pipeline, report)
+
+    if not pipeline or not PASSES[pipeline[-1][0]].analysis:
+        start = time.perf_counter()
+        json.dump(bril, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.flush()
+        if timing:
+            report.append(('(dump)', time.perf_counter() - start,
+                           count_instrs(bril), 0))
+
+    if timing:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    opt([a for a in sys.argv[1:] if a != '-t'], '-t' in sys.argv[1:])
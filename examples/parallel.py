@@ -0,0 +1,61 @@
+"""Run a per-function transformation over a whole program, optionally in a
+pool of worker processes.
+
+Functions are independent, so a pass that handles one function at a time
+can process them in parallel. With `--jobs N`, the drivers in this
+directory send the functions to a `ProcessPoolExecutor` in batches and
+put the transformed copies back in their original order, so the output
+is the same as the serial version's. Small programs are not worth the
+cost of starting the pool, so they always run serially.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Programs with fewer instructions than this run serially.
+MIN_INSTRS = 10000
+
+# Send each worker about this many batches, to balance the load without
+# paying for a round trip per function.
+BATCHES_PER_JOB = 4
+
+
+def pop_jobs(argv):
+    """Remove a `--jobs N` option from a list of command-line arguments
+    (in place) and return N, or None if it is not there. `--jobs 0` means
+    one job per CPU.
+    """
+    if '--jobs' not in argv:
+        return None
+    i = argv.index('--jobs')
+    jobs = int(argv[i + 1])
+    del argv[i:i + 2]
+    return jobs or os.cpu_count()
+
+
+def _apply(transform, func):
+    return func, transform(func)
+
+
+def map_functions(transform, bril, jobs=None, min_instrs=MIN_INSTRS):
+    """Apply `transform` to every function in a program and return the
+    list of its results, in order.
+
+    `transform` takes a function, which it may modify in place. With more
+    than one job, and if the program has at least `min_instrs`
+    instructions, each worker gets a copy of its functions, and the
+    modified copies replace the originals in `bril['functions']`. In this
+    case, `transform` and its results must be picklable (e.g., a
+    module-level function or a `functools.partial` of one).
+    """
+    funcs = bril['functions']
+    size = sum(len(func['instrs']) for func in funcs)
+    if not jobs or jobs <= 1 or len(funcs) <= 1 or size < min_instrs:
+        return [transform(func) for func in funcs]
+
+    jobs = min(jobs, len(funcs))
+    chunksize = max(1, len(funcs) // (jobs * BATCHES_PER_JOB))
+    with ProcessPoolExecutor(jobs) as pool:
+        done = list(pool.map(_apply, [transform] * len(funcs), funcs,
+                             chunksize=chunksize))
+    funcs[:] = [func for func, _ in done]
+    return [result for _, result in done]
@@ -0,0 +1,197 @@
+"""Sparse conditional constant propagation for Bril programs in SSA form.
+
+This is the algorithm from Wegman and Zadeck ("Constant Propagation with
+Conditional Branches", 1991). Unlike the dense `cprop` analysis in
+`df.py`, it propagates values along SSA def-use edges instead of
+recomputing whole blocks, and it only follows the CFG edges that can
+actually execute given what it knows about branch conditions. Afterward,
+it replaces constant variables with `const` instructions, rewrites
+constant branches into jumps, and deletes the blocks that can never run.
+
+Run it on the output of `to_ssa.py`:
+
+    bril2json < prog.bril | python3 to_ssa.py | python3 sccp.py
+"""
+import json
+import sys
+
+from cfg import (block_map, add_terminators, drop_fallthroughs, reassemble,
+                 CompactCFG)
+from defuse import DefUse
+from fold import FOLDABLE_OPS
+from form_blocks import form_blocks
+from from_ssa import UNDEFINED
+from is_ssa import is_ssa_func
+
+# The lattice of values. Every variable starts out at TOP (we have not
+# seen it execute yet), may become a constant, and becomes BOTTOM once it
+# can have more than one value.
+TOP = object()
+BOTTOM = object()
+
+
+def _meet(a, b):
+    if a is TOP:
+        return b
+    if b is TOP:
+        return a
+    if a is BOTTOM or b is BOTTOM or a != b:
+        return BOTTOM
+    return a
+
+
+def _eval(instr, values):
+    """Compute the value of a (non-phi) value instruction from the values
+    of its arguments.
+    """
+    op = instr['op']
+    if op == 'const':
+        return instr['value']
+    args = [values.get(a, TOP) for a in instr.get('args', [])]
+    if op == 'id':
+        return args[0]
+    if op not in FOLDABLE_OPS or any(a is BOTTOM for a in args):
+        return BOTTOM
+    if any(a is TOP for a in args):
+        return TOP
+    if op == 'div' and args[1] == 0:
+        return BOTTOM  # Leave the error for run time.
+    return FOLDABLE_OPS[op](*args)
+
+
+def sccp_func(func, analyses=None):
+    """Apply sparse conditional constant propagation to a function in
+    place. Functions that are not in SSA form are left alone.
+
+    If `analyses` (an `analyses.FunctionAnalyses`) is given, take the
+    blocks, CFG, and def-use index from it. The cached blocks are modified
+    in place, so the caller must invalidate the analyses afterward.
+    """
+    if not is_ssa_func(func):
+        return
+
+    if analyses is None:
+        blocks = block_map(form_blocks(func['instrs']))
+        add_terminators(blocks)
+        graph = CompactCFG.from_block_map(blocks)
+        defuse = DefUse(blocks)
+    else:
+        blocks = analyses['blocks']
+        graph = analyses['blocks_compact']
+        defuse = analyses['defuse']
+    ids = graph.ids
+
+    # We know nothing about the arguments.
+    values = {arg['name']: BOTTOM for arg in func.get('args', [])}
+
+    # The CFG edges (as pairs of block ids) that can execute, and the
+    # blocks with at least one such in-edge.
+    executable = set()
+    reached = bytearray(len(graph))
+
+    # The two worklists: CFG edges that have become executable (starting
+    # with a pseudo-edge into the entry) and variables whose values have
+    # changed.
+    flow = [(-1, 0)]
+    ssa = []
+
+    def _update(var, val):
+        if values.get(var, TOP) != val:
+            values[var] = val
+            ssa.append(var)
+
+    def _visit(b, instr):
+        op = instr.get('op')
+        if op == 'phi':
+            val = TOP
+            for label, arg in zip(instr['labels'], instr['args']):
+                if arg != UNDEFINED and (ids[label], b) in executable:
+                    val = _meet(val, values.get(arg, TOP))
+            _update(instr['dest'], val)
+        elif op == 'br':
+            # A condition that is still TOP here can only come from an
+            # undefined variable. Following both edges is always safe.
+            cond = values.get(instr['args'][0], TOP)
+            if cond is TOP or cond is BOTTOM:
+                targets = instr['labels']
+            else:
+                targets = [instr['labels'][0 if cond else 1]]
+            flow.extend((b, ids[t]) for t in targets)
+        elif op == 'jmp':
+            flow.append((b, ids[instr['labels'][0]]))
+        elif 'dest' in instr:
+            _update(instr['dest'], _eval(instr, values))
+
+    while flow or ssa:
+        while flow:
+            edge = flow.pop()
+            if edge in executable:
+                continue
+            executable.add(edge)
+            _, s = edge
+            if reached[s]:
+                # Only the phi-nodes can see the new edge.
+                for instr in graph.blocks[s]:
+                    if instr.get('op') == 'phi':
+                        _visit(s, instr)
+            else:
+                reached[s] = 1
+                for instr in graph.blocks[s]:
+                    _visit(s, instr)
+
+        while ssa:
+            var = ssa.pop()
+            for name, i in defuse.uses(var):
+                b = ids[name]
+                if reached[b]:
+                    _visit(b, graph.blocks[b][i])
+
+    # Rewrite the function: delete unreachable blocks, replace constants,
+    # drop phi-node arguments from dead edges, and turn branches with
+    # constant conditions into jumps.
+    for b, name in enumerate(graph.labels):
+        if not reached[b]:
+            del blocks[name]
+            continue
+
+        # Keep the remaining phi-nodes at the top of the block.
+        phis = []
+        rest = []
+        for instr in blocks[name]:
+            op = instr.get('op')
+            val = values.get(instr.get('dest'), TOP)
+            if 'dest' in instr and val is not TOP and val is not BOTTOM:
+                instr = {'op': 'const', 'dest': instr['dest'],
+                         'type': instr['type'], 'value': val}
+            elif op == 'phi':
+                args = [(label, arg) for label, arg
+                        in zip(instr['labels'], instr['args'])
+                        if (ids[label], b) in executable]
+                instr['labels'] = [label for label, _ in args]
+                instr['args'] = [arg for _, arg in args]
+                phis.append(instr)
+                continue
+            elif op == 'br':
+                cond = values.get(instr['args'][0], TOP)
+                if cond is not TOP and cond is not BOTTOM:
+                    instr = {'op': 'jmp',
+                             'labels': [instr['labels'][0 if cond else 1]]}
+            rest.append(instr)
+        blocks[name][:] = phis + rest
+
+    drop_fallthroughs(blocks)
+    func['instrs'] = reassemble(blocks)
+
+
+def sccp(bril, analyses=None):
+    """Apply sparse conditional constant propagation to every function in
+    a program. Optionally, take the analyses it needs from an
+    `analyses.AnalysisManager`.
+    """
+    for func in bril['functions']:
+        sccp_func(func, analyses.get(func) if analyses is not None else None)
+    return bril
+
+
+if __name__ == '__main__':
+    print(json.dumps(sccp(json.load(sys.stdin)), indent=2, sort_keys=True))
@@ -1,10 +1,14 @@
 import json
+import os
 import sys
 import logging
 from copy import deepcopy
 from collections import defaultdict
 from convert_ssa import instruct_to_blocks, add_entry_blocks, add_pseudo_labels, create_cfg, find_dominators, rebuild_instructions
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import parallel
+
 logging.basicConfig(filename='debug.log', level=logging.DEBUG)
 
 def find_back_edges(dominators, blocks, cfg):
@@ -276,9 +280,13 @@ def find_licm(instructions):
     blocks = perform_licm(normalized_loops, blocks)
     return rebuild_instructions(blocks)
 
+def licm_func(fn):
+    fn["instrs"] = find_licm(fn["instrs"])
+
 if __name__ == "__main__":
+    # use `--jobs N` to optimize functions in N processes
+    jobs = parallel.pop_jobs(sys.argv)
     prog = json.load(sys.stdin)
 
-    for fn in prog["functions"]:
-        fn["instrs"] = find_licm(fn["instrs"]) 
+    parallel.map_functions(licm_func, prog, jobs)
     json.dump(prog, sys.stdout, indent=2)
\ No newline at end of file
@@ -1,9 +1,13 @@
 import json
+import os
 import sys
 import copy
 import logging
 from collections import defaultdict
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import parallel
+
 logging.basicConfig(filename='debug.log', level=logging.DEBUG)
 def check_jump(instr):
     return instr.get("op") in {"jmp", "br", "ret"}
@@ -207,9 +211,13 @@ def rebuild_instructions(blocks):
             output.append(instr)
     return output
                     
+def alias_func(fn):
+    fn["instrs"] = dataflow_analysis(fn["instrs"], fn["args"] if "args" in fn else None)
+
 if __name__ == "__main__":
+    # use `--jobs N` to optimize functions in N processes
+    jobs = parallel.pop_jobs(sys.argv)
     prog = json.load(sys.stdin)
 
-    for fn in prog["functions"]:
-        fn["instrs"] = dataflow_analysis(fn["instrs"], fn["args"] if "args" in fn else None) 
+    parallel.map_functions(alias_func, prog, jobs)
     json.dump(prog, sys.stdout, indent=2)
\ No newline at end of file
@@ -4,6 +4,11 @@ local optimization.
 
 import sys
 import json
+from collections import Counter, defaultdict
+
+import cfg
+import df
+import parallel
 from form_blocks import form_blocks
 from util import flatten
 
@@ -49,9 +54,7 @@ def trivial_dce(func):
     """Iteratively remove dead instructions, stopping when nothing
     remains to remove.
     """
-    # An exercise for the reader: prove that this loop terminates.
-    while trivial_dce_pass(func):
-        pass
+    worklist_dce(func)
 
 
 def drop_killed_local(block):
@@ -108,8 +111,155 @@ def drop_killed_pass(func):
 def trivial_dce_plus(func):
     """Like `trivial_dce`, but also deletes locally killed instructions.
     """
-    while trivial_dce_pass(func) or drop_killed_pass(func):
-        pass
+    worklist_dce(func, drop_killed=True)
+
+
+def worklist_dce(func, drop_killed=False):
+    """Remove the same instructions as iterating `trivial_dce_pass` (and,
+    with `drop_killed`, `drop_killed_pass`) to a fixed point, but in a
+    single pass.
+
+    Instead of rescanning the function after every round, keep a count of
+    the uses of each variable. Deleting an instruction decrements the
+    counts for its arguments, and a variable whose count drops to zero
+    makes all its definitions dead. To find killed definitions, link each
+    variable's occurrences within a block into a list: deleting a use can
+    leave a definition followed directly by another definition.
+    """
+    blocks = list(form_blocks(func['instrs']))
+    instrs = flatten(blocks)
+
+    uses = Counter()
+    defs = defaultdict(list)
+    for i, instr in enumerate(instrs):
+        uses.update(instr.get('args', []))
+        if 'dest' in instr:
+            defs[instr['dest']].append(i)
+
+    # Start with the definitions of variables that are never used.
+    work = [i for var, ds in defs.items() if not uses[var] for i in ds]
+
+    if drop_killed:
+        # The occurrences of variables in each block, in order: each use
+        # of an argument and then the definition of the destination. For
+        # each occurrence, record its instruction, whether it is a
+        # definition, and the previous and next occurrences of the same
+        # variable in the block (or -1).
+        occ_instr = []
+        occ_def = []
+        prev = []
+        next_ = []
+        instr_occs = [[] for _ in instrs]
+        i = 0
+        for block in blocks:
+            last = {}
+            for instr in block:
+                occs = [(a, False) for a in instr.get('args', [])]
+                if 'dest' in instr:
+                    occs.append((instr['dest'], True))
+                for var, is_def in occs:
+                    o = len(occ_instr)
+                    occ_instr.append(i)
+                    occ_def.append(is_def)
+                    prev.append(last.get(var, -1))
+                    next_.append(-1)
+                    if prev[o] >= 0:
+                        next_[prev[o]] = o
+                    last[var] = o
+                    instr_occs[i].append(o)
+                i += 1
+
+        # Definitions that are already killed.
+        work += [occ_instr[o] for o in range(len(occ_instr))
+                 if occ_def[o] and next_[o] >= 0 and occ_def[next_[o]]]
+
+    dead = bytearray(len(instrs))
+    while work:
+        i = work.pop()
+        if dead[i]:
+            continue
+        dead[i] = 1
+
+        for var in instrs[i].get('args', []):
+            uses[var] -= 1
+            if not uses[var]:
+                work += defs[var]
+
+        if drop_killed:
+            # Unlink the instruction's occurrences. If that leaves two
+            # definitions next to each other, the first one is killed.
+            for o in instr_occs[i]:
+                p, n = prev[o], next_[o]
+                if p >= 0:
+                    next_[p] = n
+                if n >= 0:
+                    prev[n] = p
+                if p >= 0 and n >= 0 and occ_def[p] and occ_def[n]:
+                    work.append(occ_instr[p])
+
+    # Delete the dead instructions from each block.
+    i = 0
+    for block in blocks:
+        new_block = [instr for j, instr in enumerate(block, i)
+                     if not dead[j]]
+        i += len(block)
+        block[:] = new_block
+    func['instrs'] = flatten(blocks)
+
+
+def _strong_live(block, out):
+    # A variable is live if it is used by an effect instruction or in the
+    # definition of another live variable.
+    live = set(out)
+    for instr in reversed(block):
+        if 'dest' in instr:
+            if instr['dest'] not in live:
+                continue
+            live.discard(instr['dest'])
+        live.update(instr.get('args', []))
+    return live
+
+
+# The strong liveness analysis for `global_dce`.
+STRONG_LIVE = df.Analysis(False, set(), df.union, _strong_live)
+
+
+def global_dce(func, analyses=None):
+    """Remove the instructions whose results can never reach an effect
+    instruction, using a liveness analysis over the whole CFG.
+
+    This is a stronger form of liveness (sometimes called *faint
+    variables*) where the arguments of a dead instruction do not count
+    as uses, so it also removes unused cycles of definitions (like a loop
+    counter that is never read after the loop) that `trivial_dce_plus`
+    keeps. It needs only one round, since the analysis already accounts
+    for everything that would become dead. If `analyses` (an
+    `analyses.FunctionAnalyses`) is given, take the liveness from it.
+    """
+    blocks = list(form_blocks(func['instrs']))
+
+    if analyses is None:
+        # Solve the analysis on a copy of the blocks with terminators.
+        graph = cfg.block_map(list(b) for b in blocks)
+        cfg.add_terminators(graph)
+        graph = cfg.CompactCFG.from_block_map(graph)
+        _, live_out = df.df_worklist_compact(graph, STRONG_LIVE)
+    else:
+        # The cached blocks are in the same order.
+        live_out = analyses.dataflow(STRONG_LIVE)[1].values()
+
+    for block, live in zip(blocks, live_out):
+        live = set(live)
+        new_block = []
+        for instr in reversed(block):
+            if 'dest' in instr:
+                if instr['dest'] not in live:
+                    continue
+                live.discard(instr['dest'])
+            live.update(instr.get('args', []))
+            new_block.append(instr)
+        block[:] = reversed(new_block)
+    func['instrs'] = flatten(blocks)
 
 
 MODES = {
@@ -117,19 +267,22 @@ MODES = {
     'tdcep': trivial_dce_pass,
     'dkp': drop_killed_pass,
     'tdce+': trivial_dce_plus,
+    'live': global_dce,
 }
 
 
 def localopt():
-    if len(sys.argv) > 1:
-        modify_func = MODES[sys.argv[1]]
+    # Use `--jobs N` to optimize functions in N processes.
+    args = sys.argv[1:]
+    jobs = parallel.pop_jobs(args)
+    if args:
+        modify_func = MODES[args[0]]
     else:
         modify_func = trivial_dce
 
     # Apply the change to all the functions in the input program.
     bril = json.load(sys.stdin)
-    for func in bril['functions']:
-        modify_func(func)
+    parallel.map_functions(modify_func, bril, jobs)
     json.dump(bril, sys.stdout, indent=2, sort_keys=True)
 
 
@@ -0,0 +1,104 @@
+"""Check that a `DefUse` stays consistent as it is edited. Make each kind
+of edit at every position in every function of a program, and after each
+one, compare the index with a fresh one built from the edited blocks.
+
+    bril2json < prog.bril | python3 mutations.py
+"""
+# CMD: for f in *.bril; do echo $f; bril2json < $f | python3 {filename}; done
+import copy
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..'))
+import cfg  # noqa: E402
+from defuse import DefUse  # noqa: E402
+from form_blocks import form_blocks  # noqa: E402
+
+
+def snapshot(index):
+    """Everything a `DefUse` can tell us, for comparison. (It does not
+    promise any order for the positions.)
+    """
+    return {
+        var: (sorted(index.defs(var)), sorted(index.uses(var)),
+              index.num_defs(var), index.num_uses(var))
+        for var in index.variables()
+    }
+
+
+def positions(index):
+    return [(name, i) for name, block in index.blocks.items()
+            for i in range(len(block))]
+
+
+def _delete(index):
+    # Delete the last instruction of each block until all are empty.
+    for name, block in index.blocks.items():
+        while block:
+            index.delete(name, len(block) - 1)
+            yield 'delete {}[{}]'.format(name, len(block))
+
+
+def _insert(index):
+    # Insert a copy of every instruction just before it.
+    for name, i in reversed(positions(index)):
+        index.insert(name, i, copy.deepcopy(index.blocks[name][i]))
+        yield 'insert {}[{}]'.format(name, i)
+
+
+def _replace(index):
+    # Replace every instruction with a copy that reads its arguments in
+    # reverse order.
+    for name, i in positions(index):
+        instr = copy.deepcopy(index.blocks[name][i])
+        if 'args' in instr:
+            instr['args'].reverse()
+        index.replace(name, i, instr)
+        yield 'replace {}[{}]'.format(name, i)
+
+
+def _rename(index):
+    # Rename every variable to itself, to a fresh name, and then to
+    # another variable that is already there.
+    names = sorted(index.variables())
+    for var in names:
+        index.rename(var, var)
+        yield 'rename {} {}'.format(var, var)
+    for var in names:
+        index.rename(var, var + '.new')
+        yield 'rename {} {}.new'.format(var, var)
+    for var, other in zip(names, names[1:]):
+        index.rename(var + '.new', other + '.new')
+        yield 'rename {}.new {}.new'.format(var, other)
+
+
+EDITS = {
+    'delete': _delete,
+    'insert': _insert,
+    'replace': _replace,
+    'rename': _rename,
+}
+
+
+def check(bril):
+    for func in bril['functions']:
+        for kind, edit in EDITS.items():
+            blocks = cfg.block_map(form_blocks(copy.deepcopy(func['instrs'])))
+            cfg.add_terminators(blocks)
+            index = DefUse(blocks)
+            count = 0
+            for desc in edit(index):
+                if snapshot(index) != snapshot(DefUse(index.blocks)):
+                    print('@{}: {} is inconsistent'.format(func['name'],
+                                                           desc))
+                    break
+                count += 1
+            else:
+                print('@{}: {} edits of kind {} ok'.format(func['name'],
+                                                           count, kind))
+
+
+if __name__ == '__main__':
+    check(json.load(sys.stdin))
@@ -1,13 +1,14 @@
+import functools
 import json
 import sys
 from collections import defaultdict
 
-from cfg import block_map, successors, add_terminators, add_entry, reassemble
+from cfg import block_map, add_terminators, add_entry, reassemble, CompactCFG
 from form_blocks import form_blocks
-from dom import get_dom, dom_fronts, dom_tree
+from dom import Dominators
+import df
+import parallel
 
-import logging
-logging.basicConfig(filename='debug.log', level=logging.DEBUG)
 
 def def_blocks(blocks):
     """Get a map from variable names to defining blocks.
@@ -20,76 +21,129 @@ def def_blocks(blocks):
     return dict(out)
 
 
-def get_phis(blocks, df, defs):
+def get_phis(blocks, dominators, defs, live=None, stats=None):
     """Find where to insert phi-nodes in the blocks.
 
     Produce a map from block names to variable names that need phi-nodes
     in those blocks. (We will need to generate names and actually insert
-    instructions later.)
+    instructions later.) A variable needs a phi-node in the iterated
+    dominance frontier of the blocks that define it; `dominators` is the
+    `dom.Dominators` for the blocks.
+
+    If `live` is given, it maps block names to the variables that may be
+    live on entry to them, and other variables don't get phi-nodes there
+    (see `PRUNING`). Count the phi-nodes left out this way in
+    `stats['phis_avoided']`.
     """
+    ids, labels = dominators.graph.ids, dominators.graph.labels
     phis = {b: set() for b in blocks}
+    avoided = 0
     for v, v_defs in defs.items():
-        v_defs_list = list(v_defs)
-        for d in v_defs_list:
-            for block in df[d]:
-                # Add a phi-node...
-                if v not in phis[block]:
-                    # ..unless we already did.
-                    phis[block].add(v)
-                    if block not in v_defs_list:
-                        v_defs_list.append(block)
+        for block in dominators.iterated_frontier(ids[d] for d in v_defs):
+            name = labels[block]
+            if live is None or v in live[name]:
+                phis[name].add(v)
+            else:
+                avoided += 1
+    if stats is not None:
+        stats['phis_avoided'] = stats.get('phis_avoided', 0) + avoided
     return phis
 
 
+def global_names(blocks):
+    """Get the variables that are read in some block before being written
+    in it. Only these "global" names can be live across a block boundary.
+    """
+    out = set()
+    for block in blocks.values():
+        out.update(df.use(block))
+    return out
+
+
+def _semi_pruned(blocks, analyses):
+    names = global_names(blocks)
+    return {b: names for b in blocks}
+
+
+def _pruned(blocks, analyses):
+    if analyses is not None:
+        # The cached liveness is for the blocks without an added entry
+        # block, but that block can never need phi-nodes.
+        live_in = analyses['live'][0]
+        return {b: live_in.get(b, ()) for b in blocks}
+    return df.df_worklist(blocks, df.ANALYSES['live'])[0]
+
+
+# Ways to leave out phi-nodes that can never be used. Each takes the
+# blocks (and the `analyses.FunctionAnalyses`, if any) and produces the
+# `live` map for `get_phis`.
+# - semi: Semi-pruned SSA (Briggs et al.). Only place phi-nodes for
+#   variables that are read in some block before being written in it.
+# - pruned: Only place a phi-node where the variable is live.
+PRUNING = {
+    'semi': _semi_pruned,
+    'pruned': _pruned,
+}
+
+
 def ssa_rename(blocks, phis, succ, domtree, args):
+    # The stack of names for each variable, with the current one on top.
     stack = defaultdict(list, {v: [v] for v in args})
     phi_args = {b: {p: [] for p in phis[b]} for b in blocks}
     phi_dests = {b: {p: None for p in phis[b]} for b in blocks}
     counters = defaultdict(int)
 
-    def _push_fresh(var):
+    def _push_fresh(var, pushed):
         fresh = '{}.{}'.format(var, counters[var])
         counters[var] += 1
-        stack[var].insert(0, fresh)
+        stack[var].append(fresh)
+        pushed.append(var)
         return fresh
 
     def _rename(block):
-        # Save stacks.
-        old_stack = {k: list(v) for k, v in stack.items()}
+        # Return the variables whose stacks we push to, so we can pop
+        # them again after renaming the block's dominator subtree.
+        pushed = []
 
         # Rename phi-node destinations.
         for p in phis[block]:
-            phi_dests[block][p] = _push_fresh(p)
+            phi_dests[block][p] = _push_fresh(p, pushed)
 
         for instr in blocks[block]:
             # Rename arguments in normal instructions.
             if 'args' in instr:
-                new_args = [stack[arg][0] for arg in instr['args']]
+                new_args = [stack[arg][-1] for arg in instr['args']]
                 instr['args'] = new_args
 
             # Rename destinations.
             if 'dest' in instr:
-                instr['dest'] = _push_fresh(instr['dest'])
+                instr['dest'] = _push_fresh(instr['dest'], pushed)
 
         # Rename phi-node arguments (in successors).
         for s in succ[block]:
             for p in phis[s]:
                 if stack[p]:
-                    phi_args[s][p].append((block, stack[p][0]))
+                    phi_args[s][p].append((block, stack[p][-1]))
                 else:
                     # The variable is not defined on this path
                     phi_args[s][p].append((block, "__undefined"))
 
-        # Recursive calls.
-        for b in sorted(domtree[block]):
-            _rename(b)
+        return pushed
 
-        # Restore stacks.
-        stack.clear()
-        stack.update(old_stack)
+    # Walk the dominator tree in preorder with an explicit stack (deep
+    # trees would exceed Python's recursion limit). After a block's
+    # children, the stack holds the list of variables it pushed, and
+    # popping that list restores the stacks for its siblings.
+    work = [list(blocks.keys())[0]]
+    while work:
+        item = work.pop()
+        if isinstance(item, list):
+            for var in item:
+                stack[var].pop()
+            continue
 
-    entry = list(blocks.keys())[0]
-    _rename(entry)
+        work.append(_rename(item))
+        work.extend(sorted(domtree[item], reverse=True))
 
     return phi_args, phi_dests
 
@@ -118,32 +172,85 @@ def get_types(func):
     return types
 
 
-def func_to_ssa(func):
-    blocks = block_map(form_blocks(func['instrs']))
-    add_entry(blocks)
-    add_terminators(blocks)
-    succ = {name: successors(block[-1]) for name, block in blocks.items()}
-    dom = get_dom(succ, list(blocks.keys())[0])
-    logging.debug(f"correct dominators {dom}")
-    df = dom_fronts(dom, succ)
-    logging.debug(f"correct df {df}")
+def func_to_ssa(func, analyses=None, pruning=None, stats=None):
+    """Convert a function to SSA form in place.
+
+    `pruning` names a way to leave out useless phi-nodes (see `PRUNING`);
+    by default, we build minimal SSA. If `analyses` (an
+    `analyses.FunctionAnalyses`) is given, take the CFG, dominance, and
+    liveness information from it instead of recomputing them. The
+    cached blocks of `cfg` are modified in place and become the new
+    function's `blocks`, so the CFG and its dominators are kept as
+    `analyses.BLOCK_ANALYSES`. Everything else is invalidated: the new
+    phi-nodes' labels can change the CFG's entry (see `add_entry`).
+    """
+    if analyses is None:
+        blocks = block_map(form_blocks(func['instrs']))
+        add_entry(blocks)
+        add_terminators(blocks)
+        graph = CompactCFG.from_block_map(blocks)
+        succ = graph.edges()[1]
+        dominators = Dominators(graph)
+        tree = dominators.tree()
+    else:
+        blocks = analyses['cfg']
+        succ = analyses['succ']
+        dominators = analyses['idom']
+        tree = analyses['dom_tree']
     defs = def_blocks(blocks)
     types = get_types(func)
     arg_names = {a['name'] for a in func['args']} if 'args' in func else set()
 
-    phis = get_phis(blocks, df, defs)
-    phi_args, phi_dests = ssa_rename(blocks, phis, succ, dom_tree(dom),
-                                     arg_names)
+    live = PRUNING[pruning](blocks, analyses) if pruning else None
+    phis = get_phis(blocks, dominators, defs, live, stats)
+    phi_args, phi_dests = ssa_rename(blocks, phis, succ, tree, arg_names)
     insert_phis(blocks, phi_args, phi_dests, types)
 
     func['instrs'] = reassemble(blocks)
+    if analyses is not None:
+        analyses.rebase({'cfg': 'blocks', 'compact': 'blocks_compact',
+                         'idom': 'blocks_idom'})
 
 
-def to_ssa(bril):
-    for func in bril['functions']:
-        func_to_ssa(func)
+def _func_to_ssa_stats(func, pruning):
+    # Convert a function and return its own stats, which (unlike a shared
+    # dict) survive the trip back from a worker process.
+    stats = {}
+    func_to_ssa(func, pruning=pruning, stats=stats)
+    return stats
+
+
+def to_ssa(bril, analyses=None, pruning=None, stats=None, jobs=None):
+    """Convert every function in a program to SSA form. Optionally, use
+    and update the cached results in an `analyses.AnalysisManager`, or
+    convert the functions in `jobs` parallel processes (see
+    `parallel.map_functions`).
+    """
+    if analyses is not None:
+        for func in bril['functions']:
+            func_to_ssa(func, analyses.get(func), pruning, stats)
+        return bril
+
+    results = parallel.map_functions(
+        functools.partial(_func_to_ssa_stats, pruning=pruning), bril, jobs,
+    )
+    if stats is not None:
+        for func_stats in results:
+            for key, value in func_stats.items():
+                stats[key] = stats.get(key, 0) + value
     return bril
 
 
 if __name__ == '__main__':
-    print(json.dumps(to_ssa(json.load(sys.stdin)), indent=2, sort_keys=True))
+    # Use `semi` or `pruned` to choose a pruning mode, `-s` to report the
+    # number of phi-nodes it avoided (on stderr), and `--jobs N` to
+    # convert functions in N processes.
+    jobs = parallel.pop_jobs(sys.argv)
+    args = [a for a in sys.argv[1:] if a != '-s']
+    stats = {'phis_avoided': 0}
+    bril = to_ssa(json.load(sys.stdin), pruning=args[0] if args else None,
+                  stats=stats, jobs=jobs)
+    print(json.dumps(bril, indent=2, sort_keys=True))
+    if '-s' in sys.argv[1:]:
+        print('phis avoided: {}'.format(stats['phis_avoided']),
+              file=sys.stderr)
@@ -1,8 +1,8 @@
 """Type inference for Bril
 """
+import heapq
 import json
 import sys
-import copy
 
 ARITHMETIC_OPS = ["add", "mul", "sub", "div"]
 COMPARISON_OPS = ["eq", "lt", "gt", "le", "ge"]
@@ -20,77 +20,110 @@ def type_var(gamma, var, expected_type, i):
     gamma[var] = expected_type
 
 
-# Runtime is O(n^2) where n is the number of instructions, because of
-# main {
-#   jmp l2;
-# l1:
-#   a = id b;
-#   b = id c;
-#   c = id d;
-#   ...
-#   y = id z;
-#   ret;
-# l2:
-#   z = const 0;
-# }
 def infer_types_func(func):
+    """Infer the types of the variables in a function and return a copy
+    of the function with a type on every instruction whose destination's
+    type we know. The copy shares the untouched instructions with `func`.
+
+    Most instructions constrain their arguments and destination to fixed
+    types. The exception is `id`, which gives its destination the type of
+    its argument: we record each one as an edge in a graph from the
+    argument to the destination and propagate types along the edges.
+    Each variable's type is propagated once (when it becomes known), so
+    this takes O(n log n) time even when a chain of `id`s appears in the
+    opposite order from the definitions, like this:
+
+        main {
+          jmp l2;
+        l1:
+          a = id b;
+          b = id c;
+          ...
+          y = id z;
+          ret;
+        l2:
+          z = const 0;
+        }
+
+    To report the same conflict as a naive inference that sweeps over the
+    instructions until nothing changes, we apply the constraints in the
+    order that sweep would: by sweep number, then instruction index. The
+    fixed constraints all apply in the first sweep. An `id` applies in the
+    same sweep as the one that typed its argument, if that came from an
+    earlier instruction, and otherwise in the next one.
+    """
     gamma = {}
-    typed_func = copy.deepcopy(func)
-    # Keep track of whether or not any type was inferred.
-    # If so, then we need to try type checking again, because for `id` ops,
-    # e.g. "x = id y", we need to know the type of `y` first, which may not
-    # happen until later in the program because we're going sequentially
-    # through the instructions
-    old_gamma_size = -1
-    while len(gamma) != old_gamma_size:
-        old_gamma_size = len(gamma)
-        for i, instr in enumerate(typed_func["instrs"]):
-            # Continue if we have a label
-            if "op" not in instr:
-                continue
-
-            # Handle constants
-            if instr["op"] == "const":
-                if instr["value"] is True or instr["value"] is False:
-                    type_var(gamma, instr["dest"], "bool", i)
-                else:
-                    type_var(gamma, instr["dest"], "int", i)
-
-            # Handle effect operations
-            if instr["op"] == "ret" or instr["op"] == "jmp":
-                continue
-
-            # Handle value operations
-            elif instr["op"] in ARITHMETIC_OPS:
-                for arg in instr["args"]:
-                    type_var(gamma, arg, "int", i)
-                type_var(gamma, instr["dest"], "int", i)
-
-            elif instr["op"] in COMPARISON_OPS:
-                for arg in instr["args"]:
-                    type_var(gamma, arg, "int", i)
-                type_var(gamma, instr["dest"], "bool", i)
-
-            elif instr["op"] in LOGIC_OPS:
-                for arg in instr["args"]:
-                    type_var(gamma, arg, "bool", i)
-                type_var(gamma, instr["dest"], "bool", i)
 
-            elif instr["op"] == "br":
-                type_var(gamma, instr["args"][0], "bool", i)
-
-            # Handle misc. operations
-            elif instr["op"] == "print" or instr["op"] == "nop":
-                continue
-            elif instr["op"] == "id" and instr["args"][0] in gamma:
-                type_var(gamma, instr["dest"], gamma[instr["args"][0]], i)
-
-            # Set the type for this instruction to be whatever we've inferred
-            if "dest" in instr and instr["dest"] in gamma:
-                typed_func["instrs"][i]["type"] = gamma[instr["dest"]]
-        # end for over instructions
-    # end while
-    return typed_func
+    # For each variable, the `id` instructions that copy it, as pairs of
+    # destination and instruction index.
+    copies = {}
+
+    # The constraints to apply, as a heap of (sweep, instruction index,
+    # position in the instruction, variable, type) tuples.
+    constraints = []
+
+    for i, instr in enumerate(func["instrs"]):
+        # Continue if we have a label
+        if "op" not in instr:
+            continue
+
+        # Handle constants
+        if instr["op"] == "const":
+            if instr["value"] is True or instr["value"] is False:
+                types = [(instr["dest"], "bool")]
+            else:
+                types = [(instr["dest"], "int")]
+
+        # Handle value operations
+        elif instr["op"] in ARITHMETIC_OPS:
+            types = [(arg, "int") for arg in instr["args"]]
+            types.append((instr["dest"], "int"))
+
+        elif instr["op"] in COMPARISON_OPS:
+            types = [(arg, "int") for arg in instr["args"]]
+            types.append((instr["dest"], "bool"))
+
+        elif instr["op"] in LOGIC_OPS:
+            types = [(arg, "bool") for arg in instr["args"]]
+            types.append((instr["dest"], "bool"))
+
+        elif instr["op"] == "br":
+            types = [(instr["args"][0], "bool")]
+
+        # Add an edge for copies
+        elif instr["op"] == "id":
+            copies.setdefault(instr["args"][0], []).append(
+                (instr["dest"], i)
+            )
+            continue
+
+        else:
+            continue
+
+        for pos, (var, typ) in enumerate(types):
+            constraints.append((0, i, pos, var, typ))
+
+    # The constraints are already in order, so the list is a valid heap.
+    # Apply them, and propagate each variable's type along the `id` edges
+    # when it first becomes known.
+    while constraints:
+        sweep, i, _, var, typ = heapq.heappop(constraints)
+        if var in gamma:
+            type_var(gamma, var, typ, i)
+            continue
+        gamma[var] = typ
+        for dest, j in copies.get(var, []):
+            heapq.heappush(constraints, (
+                sweep if i < j else sweep + 1, j, 0, dest, typ,
+            ))
+
+    # Set the type for each instruction to be whatever we've inferred
+    typed_instrs = []
+    for instr in func["instrs"]:
+        if "dest" in instr and instr["dest"] in gamma:
+            instr = dict(instr, type=gamma[instr["dest"]])
+        typed_instrs.append(instr)
+    return dict(func, instrs=typed_instrs)
 
 def infer_types(bril):
     typed_bril = {"functions": []}
@@ -0,0 +1,25 @@
+"""Generate a long chain of `id` instructions that appear in the opposite
+order from the definitions they depend on. The old fixed-point inference
+took quadratic time on this program.
+
+    python3 idchain.py N
+"""
+import sys
+
+
+def idchain(n):
+    print('@main {')
+    print('  jmp .end;')
+    print('.chain:')
+    for i in range(n):
+        print('  v{} = id v{};'.format(i, i + 1))
+    print('  print v0;')
+    print('  ret;')
+    print('.end:')
+    print('  v{} = const 0;'.format(n))
+    print('  jmp .chain;')
+    print('}')
+
+
+if __name__ == '__main__':
+    idchain(int(sys.argv[1]))